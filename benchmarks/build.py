@@ -0,0 +1,39 @@
+"""Requests sent and wall time of a library build with each build strategy,
+against a local synthetic server that takes a few milliseconds to answer
+each request.
+
+    python -m benchmarks.build [artists] """
+
+import contextlib
+import io
+import sys
+import tempfile
+import time
+
+import pysonic
+from benchmarks import synthetic
+
+
+def main() -> None:
+    artists = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    server = synthetic.SyntheticServer(synthetic.Catalogue(artists=artists, albums=5, songs=10), delay=0.005)
+    reference = None
+    for strategy, workers in (('artist', 1), ('artist', 8), ('bulk', 1), ('bulk', 8)):
+        pysonic.state.root_dir = tempfile.mkdtemp()
+        client = pysonic.Server(0, "bench", "user", server.password, server.url, bitrate="", workers=workers,
+                                build_strategy=strategy)
+        requests = server.requests
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.library.fill_artists()
+        elapsed = time.perf_counter() - started
+
+        tree = [(x.data_dict, [(y.data_dict, [z.data_dict for z in y]) for y in x]) for x in client.library]
+        reference = reference or tree
+        print("%-6s workers=%d: %6d requests %7.2f s, %d songs, same library: %s" % (
+            strategy, workers, server.requests - requests, elapsed, len(client.library.songs), tree == reference))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Memory held by a large folder hierarchy, alone, with the list the folder
+search used to cache on it and with the flat folder index, measured with
+tracemalloc, and the time taken by folder searches.
+
+    python -m benchmarks.folders [artists]
+
+Each artist directory holds twenty album directories of ten songs, so the
+default of 5000 artists makes 105k folders. The songs are made before
+measuring, as they are shared with the library. Every record is decoded
+from JSON, so no strings are shared with the catalogue. """
+
+import gc
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pysonic
+from benchmarks import synthetic
+from pysonic.folder import Folder, FolderIndex, folder_name
+
+QUERIES = ('album 31415', 'artist 2718', 'album')
+
+
+def build_tree(server: pysonic.Server, records: list, songs: dict) -> Folder:
+    return Folder(server=server, children=[
+        Folder(server=server, data_dict=artist, children=[
+            Folder(server=server, data_dict=album, children=[], songs=songs[album['id']]) for album in albums])
+        for artist, albums in map(json.loads, records)])
+
+
+def held(function, *args) -> tuple:
+    """Return what the function returns and the memory it holds on to. """
+
+    gc.collect()
+    tracemalloc.start()
+    res = function(*args)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return res, size
+
+
+def timed(function, *args) -> tuple:
+    started = time.perf_counter()
+    res = function(*args)
+    return res, time.perf_counter() - started
+
+
+def main() -> None:
+    artists = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pysonic.state.root_dir = tempfile.mkdtemp()
+    server = pysonic.Server(0, "bench", "user", "secret", "http://127.0.0.1:4040", bitrate="")
+    catalogue = synthetic.Catalogue(artists=artists, albums=20, songs=10)
+    records = [json.dumps([{'id': f"ar-{x['id']}", 'name': x['name']},
+                           [{'id': f"al-{y['id']}", 'parent': f"ar-{x['id']}", 'isDir': 'true', 'title': y['name'],
+                             'artist': y['artist'], 'created': y['created']}
+                            for y in catalogue.artist_albums(x['id'])]])
+               for x in catalogue.artists.values()]
+    songs = {f"al-{x}": [pysonic.Song(dict(catalogue.songs[y]), server=server) for y in catalogue.album_song_ids[x]]
+             for x in catalogue.albums}
+    del catalogue
+
+    root, tree_size = held(build_tree, server, records, songs)
+    subfolders, list_size = held(lambda: root.get_subfolders)
+    folders = len(subfolders)
+    folder_index, index_size = held(FolderIndex, root)
+    print(f"{folders} folders")
+    for name, size in (("tree", tree_size), ("tree + cached list (before)", tree_size + list_size),
+                       ("tree + index (after)", tree_size + index_size), ("index alone", index_size)):
+        print("%-28s %7.1f MB, %5.0f bytes per folder" % (name + ":", size / 1e6, size / folders))
+
+    for query in QUERIES:
+        before, elapsed = timed(lambda x: [y for y in subfolders if x in folder_name(y).lower()], query)
+        print("before search %-13r %8.2f ms, %d folders" % (query, elapsed * 1000, len(before)))
+        after, elapsed = timed(folder_index.search, query)
+        print("after  search %-13r %8.2f ms, %d folders" % (query, elapsed * 1000, len(after)))
+
+
+if __name__ == '__main__':
+    main()
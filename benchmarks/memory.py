@@ -0,0 +1,78 @@
+"""Memory held by a large library with songs, albums and artists kept the way
+they were before they were made compact, and now, measured with tracemalloc.
+
+    python -m benchmarks.memory [artists]
+
+Each artist has ten albums of ten songs, so the default of 5000 artists
+makes a library of 500k songs. Every record is decoded from JSON, so no
+strings are shared with the catalogue, as with a real response. """
+
+import gc
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pysonic
+from benchmarks import synthetic
+
+
+class Before(object):
+    """A song, album or artist as it was kept before: an instance dictionary
+    holding the server, every attribute the server sent and the children. """
+
+    def __init__(self, data_dict: dict, server: pysonic.Server, children: list = None):
+        self.server = server
+        self.data_dict = data_dict
+        self.children = children or []
+
+
+def build_before(server: pysonic.Server, records: list) -> list:
+    return [Before(artist, server, [Before(album, server, [Before(x, server) for x in songs])
+                                    for album, songs in albums])
+            for artist, albums in map(json.loads, records)]
+
+
+def build_after(server: pysonic.Server, records: list) -> pysonic.Library:
+    library = pysonic.Library(server)
+    for artist, albums in map(json.loads, records):
+        one_artist = pysonic.Artist(server=server, data_dict=artist)
+        for album, songs in albums:
+            one_artist.albums.append(pysonic.Album(album, server=server, songs=songs))
+        library.artists.append(one_artist)
+    return library
+
+
+def main() -> None:
+    artists = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    pysonic.state.root_dir = tempfile.mkdtemp()
+    server = pysonic.Server(0, "bench", "user", "secret", "http://127.0.0.1:4040", bitrate="")
+    catalogue = synthetic.Catalogue(artists=artists, albums=10, songs=10)
+    records = [json.dumps([x, [[y, catalogue.album_songs(y['id'])] for y in catalogue.artist_albums(x['id'])]])
+               for x in catalogue.artists.values()]
+    songs = len(catalogue.songs)
+    del catalogue
+    gc.collect()
+    print(f"{songs} songs")
+
+    for name, build in (("before", build_before), ("after", build_after)):
+        tracemalloc.start()
+        library = build(server, records)
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del library
+        gc.collect()
+
+        started = time.perf_counter()
+        library = build(server, records)
+        elapsed = time.perf_counter() - started
+        del library
+        gc.collect()
+        print("%-6s %8.0f MB held, %5.0f bytes per song, built in %.1f s" % (
+            name + ":", held / 1e6, held / songs, elapsed))
+
+
+if __name__ == '__main__':
+    main()
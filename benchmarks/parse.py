@@ -0,0 +1,57 @@
+"""Parse time and peak memory of large getArtists, getAlbum and search3
+responses, as XML and as JSON.
+
+    python -m benchmarks.parse [artists] """
+
+import sys
+import time
+import tracemalloc
+from xml.etree import ElementTree as ETree
+
+from benchmarks import synthetic
+from pysonic import response
+
+
+def payloads(catalogue: synthetic.Catalogue):
+    """Yield the name, the response and the tag of the items of each
+    payload. """
+
+    songs = list(catalogue.songs.values())
+    yield 'getArtists', synthetic.response(synthetic.node('artists', {'ignoredArticles': 'The'}, [
+        synthetic.node('index', {'name': 'A'}, [synthetic.node('artist', x) for x in catalogue.artists.values()])])), \
+        'artist'
+    yield 'getAlbum', synthetic.response(synthetic.node('album', catalogue.albums['1'], [
+        synthetic.node('song', x) for x in songs[:20000]])), 'song'
+    yield 'search3', synthetic.response(synthetic.node('searchResult3', {}, [
+        synthetic.node('song', x) for x in songs[:50000]])), 'song'
+
+
+def parse(mode: str, content: bytes, tag: str) -> list:
+    if mode == 'json':
+        root = response.from_json(content)
+    else:
+        root = ETree.fromstring(content)
+    return [x.attrib for x in root.iter(response.SUBSONIC_NS + tag)]
+
+
+def main() -> None:
+    artists = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    catalogue = synthetic.Catalogue(artists=artists, albums=5, songs=10)
+    print("%-10s %-4s %9s %7s %9s %9s" % ("payload", "mode", "size", "items", "time", "peak"))
+    for name, root, tag in payloads(catalogue):
+        for mode, content in (('xml', synthetic.to_xml(root)), ('json', synthetic.to_json(root))):
+            started = time.perf_counter()
+            items = parse(mode, content, tag)
+            elapsed = time.perf_counter() - started
+            del items
+
+            tracemalloc.start()
+            items = parse(mode, content, tag)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%-10s %-4s %7.1fMB %7d %7.1fms %7.1fMB" % (name, mode, len(content) / 1e6, len(items),
+                                                            elapsed * 1000, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
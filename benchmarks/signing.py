@@ -0,0 +1,57 @@
+"""Stream URLs signed per second, the way they were signed before the
+salt, password and URL building were made cheaper, and now, with and
+without TokenReuse. Nothing is sent to the server.
+
+    python -m benchmarks.signing [urls] """
+
+import hashlib
+import random
+import string
+import sys
+import tempfile
+import time
+
+from requests import Request
+
+import pysonic
+
+
+def sign_before(server: pysonic.Server, song_id: str) -> str:
+    """Sign a stream URL as it was done before: a new SystemRandom for
+    every salt character, the password decoded every time, and the URL
+    built by preparing a full request. """
+
+    salt = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(10))
+    pwd = bytes.fromhex(server.password[4:]).decode('utf-8')
+    params = {**server.default_params, 's': salt, 't': hashlib.md5(f"{pwd}{salt}".encode("ascii")).hexdigest(),
+              'id': song_id}
+    return server.session.prepare_request(Request('GET', server.server_url + "stream", params=params)).url
+
+
+def sign_now(server: pysonic.Server, song_id: str) -> str:
+    return server.sub_request(page="stream", extras={'id': song_id})
+
+
+def rate(sign, server: pysonic.Server, urls: int) -> float:
+    started = time.perf_counter()
+    for song_id in range(urls):
+        sign(server, str(song_id))
+    return urls / (time.perf_counter() - started)
+
+
+def main() -> None:
+    urls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    pysonic.state.root_dir = tempfile.mkdtemp()
+
+    def make(token_reuse: int) -> pysonic.Server:
+        return pysonic.Server(0, "bench", "user", "secret", "http://127.0.0.1:4040", bitrate="",
+                              token_reuse=token_reuse)
+
+    for name, sign, server in (("before", sign_before, make(0)),
+                               ("after", sign_now, make(0)),
+                               ("after, TokenReuse 60", sign_now, make(60))):
+        print("%-22s %9.0f URLs/s" % (name + ":", rate(sign, server, urls)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Startup time and search latency of a large library kept as a pickle,
+in the SQLite store and in the snapshot.
+
+    python -m benchmarks.store [artists]
+
+Startup is timed as the shell starts: loading the library of a server
+and answering its first search with Library.find, with the word index
+saved next to the store and without it. Each artist has ten albums of
+ten songs, so the default of 5000 artists makes a library of 500k
+songs. """
+
+import gc
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import pysonic
+from benchmarks import synthetic
+
+QUERIES = ('song 49999', 'song 314159', 'no such song')
+
+
+def build(server: pysonic.Server, catalogue: synthetic.Catalogue) -> pysonic.Library:
+    library = pysonic.Library(server)
+    for artist in catalogue.artists.values():
+        one_artist = pysonic.Artist(server=server, data_dict=dict(artist))
+        for album in catalogue.artist_albums(artist['id']):
+            one_artist.albums.append(pysonic.Album(dict(album), server=server,
+                                                   songs=[dict(x) for x in catalogue.album_songs(album['id'])]))
+        library.artists.append(one_artist)
+    library.last_update = time.time()
+    return library
+
+
+def timed(function, *args) -> tuple:
+    started = time.perf_counter()
+    res = function(*args)
+    return res, time.perf_counter() - started
+
+
+def start(name: str) -> pysonic.Server:
+    return pysonic.Server(0, f"bench-{name}", "user", "secret", "http://127.0.0.1:4040", bitrate="", storage=name)
+
+
+def main() -> None:
+    artists = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    directory = tempfile.mkdtemp()
+    pysonic.state.root_dir = directory
+    catalogue = synthetic.Catalogue(artists=artists, albums=10, songs=10)
+
+    # The pickle of an older version had to be read in full before anything could be searched, and was then scanned
+    server = pysonic.Server(0, "bench-pickle", "user", "secret", "http://127.0.0.1:4040", bitrate="")
+    library = build(server, catalogue)
+    print(f"{len(library.songs)} songs")
+    library.update_server(None)
+    with open(server.pickle_file, "wb") as output:
+        pickle.dump(library, output, pickle.HIGHEST_PROTOCOL)
+    del library
+    gc.collect()
+    with open(server.pickle_file, "rb") as source:
+        library, elapsed = timed(pickle.load, source)
+    print("pickle    startup %19.1f ms, %.0f MB" % (elapsed * 1000, os.path.getsize(server.pickle_file) / 1e6))
+    for query in QUERIES:
+        found, elapsed = timed(lambda x: [y for y in library.songs if x in y.data_dict['title'].lower()], query)
+        print("pickle    search %-14r %11.2f ms, %d songs" % (query, elapsed * 1000, len(found)))
+    del library, found
+    gc.collect()
+
+    for name in ("sqlite", "snapshot"):
+        server = start(name)
+        library = build(server, catalogue)
+        library.get_token_index()
+        server.pickle(library)
+        server.store.close()
+        del library, server
+        gc.collect()
+
+        for label, keep_index in (("startup", True), ("startup, no index", False)):
+            server = start(name)
+            if not keep_index:
+                os.unlink(server.index_file)
+            started = time.perf_counter()
+            library = server.load_library()
+            found = library.find('songs', QUERIES[0])[0]
+            elapsed = time.perf_counter() - started
+            print("%-9s %-17s %9.1f ms, %.0f MB, %d songs" % (
+                name, label, elapsed * 1000, os.path.getsize(server.store_file) / 1e6, len(found)))
+            if keep_index:
+                server.store.close()
+                del library, found, server
+                gc.collect()
+
+        for query in QUERIES[1:]:
+            found, elapsed = timed(lambda x: library.find('songs', x)[0], query)
+            print("%-9s search %-14r %11.2f ms, %d songs" % (name, query, elapsed * 1000, len(found)))
+        found, elapsed = timed(library.find, 'songs', '123456')
+        print("%-9s song by ID %22.3f ms" % (name, elapsed * 1000))
+        server.store.close()
+        del library, found, server
+        gc.collect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""A synthetic Subsonic catalogue, and its responses as XML or JSON, for
+the benchmarks and the tests. Run the benchmarks from the repository
+root, e.g. python -m benchmarks.parse """
+
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import quoteattr
+
+NS = "http://subsonic.org/restapi"
+
+# A response node: tag, attributes and children
+Node = Tuple[str, dict, list]
+
+
+class Catalogue(object):
+    """Artists, albums and songs with the attributes a Subsonic server
+    sends, by ID. """
+
+    def __init__(self, artists: int = 100, albums: int = 5, songs: int = 10):
+        self.artists: Dict[str, dict] = {}
+        self.albums: Dict[str, dict] = {}
+        self.songs: Dict[str, dict] = {}
+        # The songs of each album by ID, in track order
+        self.album_song_ids: Dict[str, List[str]] = {}
+        # When the catalogue last changed, in milliseconds since the epoch, as getIndexes reports it
+        self.modified = 1577836800000
+        for artist_number in range(1, artists + 1):
+            artist = {'id': str(artist_number), 'name': f'Artist {artist_number}', 'albumCount': str(albums)}
+            self.artists[artist['id']] = artist
+            for _ in range(albums):
+                album_id = str(len(self.albums) + 1)
+                album = {'id': album_id, 'name': f'Album {album_id}', 'artist': artist['name'],
+                         'artistId': artist['id'], 'songCount': str(songs), 'duration': str(songs * 200),
+                         'created': f'2020-01-{int(album_id) % 28 + 1:02d}T00:00:00.000Z', 'year': '2001',
+                         'genre': 'Rock', 'coverArt': f'al-{album_id}'}
+                self.albums[album_id] = album
+                self.album_song_ids[album_id] = []
+                for track in range(1, songs + 1):
+                    song_id = str(len(self.songs) + 1)
+                    self.album_song_ids[album_id].append(song_id)
+                    self.songs[song_id] = {
+                        'id': song_id, 'parent': album_id, 'isDir': 'false', 'title': f'Song {song_id}',
+                        'album': album['name'], 'artist': artist['name'], 'track': str(track), 'year': '2001',
+                        'genre': 'Rock', 'coverArt': f'al-{album_id}', 'size': '7654321', 'contentType': 'audio/mpeg',
+                        'suffix': 'mp3', 'duration': '200', 'bitRate': '320',
+                        'path': f'{artist["name"]}/{album["name"]}/{track:02d} - Song {song_id}.mp3',
+                        'discNumber': '1', 'created': album['created'], 'albumId': album_id,
+                        'artistId': artist['id'], 'type': 'music'}
+
+    def artist_albums(self, artist_id: str) -> List[dict]:
+        return [x for x in self.albums.values() if x['artistId'] == artist_id]
+
+    def album_songs(self, album_id: str) -> List[dict]:
+        return [self.songs[x] for x in self.album_song_ids.get(album_id, ()) if x in self.songs]
+
+    def touch(self) -> None:
+        """Note that the catalogue changed, so that getIndexes says so. """
+
+        self.modified = max(self.modified + 1, int(time.time() * 1000))
+
+    def directory(self, folder_id: str) -> List[dict]:
+        """Return the children of a directory of the folder view, in which
+        each artist is a top level directory holding a directory for each
+        of its albums. """
+
+        if folder_id.startswith('ar-') and folder_id[3:] in self.artists:
+            return [{'id': f"al-{x['id']}", 'parent': folder_id, 'isDir': 'true', 'title': x['name'],
+                     'artist': x['artist'], 'created': x['created'], 'changed': x.get('changed', x['created'])}
+                    for x in self.artist_albums(folder_id[3:])]
+        if folder_id.startswith('al-') and folder_id[3:] in self.albums:
+            return self.album_songs(folder_id[3:])
+        return []
+
+
+def node(tag: str, attrib: dict, children: list = ()) -> Node:
+    return tag, attrib, list(children)
+
+
+def response(*children: Node) -> Node:
+    return node('subsonic-response', {'xmlns': NS, 'status': 'ok', 'version': '1.16.1'}, children)
+
+
+def to_xml(root: Node) -> bytes:
+    """Render a response as the XML a server sends. """
+
+    def render(one_node: Node) -> str:
+        tag, attrib, children = one_node
+        attributes = "".join(f" {key}={quoteattr(str(value))}" for key, value in attrib.items())
+        if not children:
+            return f"<{tag}{attributes}/>"
+        return f"<{tag}{attributes}>" + "".join(render(x) for x in children) + f"</{tag}>"
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>' + render(root)).encode('utf-8')
+
+
+def to_json(root: Node) -> bytes:
+    """Render a response as the JSON a server sends, with numbers and
+    booleans typed and repeated children as lists. """
+
+    def convert(one_node: Node) -> dict:
+        _, attrib, children = one_node
+        res = {}
+        for key, value in attrib.items():
+            if value in ('true', 'false'):
+                res[key] = value == 'true'
+            elif value.isdigit() and key not in ('id', 'parent', 'albumId', 'artistId'):
+                res[key] = int(value)
+            else:
+                res[key] = value
+        for child in children:
+            res.setdefault(child[0], []).append(convert(child))
+        return res
+
+    converted = convert(root)
+    converted.pop('xmlns')
+    return json.dumps({'subsonic-response': converted}).encode('utf-8')
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers the requests a library build makes from the catalogue of the
+    server, counting them. """
+
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, which would otherwise wait on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {key: value[0] for key, value in parse_qs(url.query, keep_blank_values=True).items()}
+        page = unquote(url.path.rsplit('/', 1)[-1]).strip()
+        server: SyntheticServer = self.server
+        signed = hashlib.md5((server.password + query.get('s', '')).encode()).hexdigest() == query.get('t')
+        with server.lock:
+            server.requests += 1
+            server.pages[page] += 1
+            server.ids.append(query.get('id'))
+            if not signed:
+                server.rejected.append(query.get('id'))
+        if server.delay:
+            time.sleep(server.delay)
+
+        if not signed:
+            root = node('subsonic-response', {'xmlns': NS, 'status': 'failed', 'version': '1.16.1'},
+                        [node('error', {'code': '40', 'message': 'Wrong username or password'})])
+        else:
+            root = response(*self.content(server.catalogue, page, query))
+        body = to_json(root) if query.get('f') == 'json' else to_xml(root)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json' if query.get('f') == 'json' else 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def content(catalogue: Catalogue, page: str, query: dict) -> List[Node]:
+        if page == 'getArtists':
+            return [node('artists', {}, [node('index', {'name': 'A'},
+                                              [node('artist', x) for x in catalogue.artists.values()])])]
+        if page == 'getArtist':
+            artist = catalogue.artists[query['id']]
+            return [node('artist', artist, [node('album', x) for x in catalogue.artist_albums(artist['id'])])]
+        if page == 'getAlbum':
+            return [node('album', catalogue.albums[query['id']],
+                         [node('song', x) for x in catalogue.album_songs(query['id'])])]
+        if page == 'getAlbumList2':
+            offset = int(query.get('offset', 0))
+            albums = sorted(catalogue.albums.values(), key=lambda x: x['name'])
+            return [node('albumList2', {}, [node('album', x) for x in
+                                            albums[offset:offset + int(query.get('size', 10))]])]
+        if page == 'getIndexes':
+            # Nothing is listed if nothing changed since the time the client gives
+            if int(query.get('ifModifiedSince', -1)) >= catalogue.modified:
+                return [node('indexes', {'lastModified': str(catalogue.modified)})]
+            return [node('indexes', {'lastModified': str(catalogue.modified)}, [node('index', {'name': 'A'}, [
+                node('artist', {'id': f"ar-{x['id']}", 'name': x['name'],
+                                **({'changed': x['changed']} if 'changed' in x else {})})
+                for x in catalogue.artists.values()])])]
+        if page == 'getMusicDirectory':
+            return [node('directory', {'id': query['id']},
+                         [node('child', x) for x in catalogue.directory(query['id'])])]
+        if page == 'search3':
+            offset = int(query.get('songOffset', 0))
+            songs = list(catalogue.songs.values())[offset:offset + int(query.get('songCount', 20))]
+            return [node('searchResult3', {}, [node('song', x) for x in songs])]
+        return []
+
+
+class SyntheticServer(ThreadingHTTPServer):
+    """A local stand-in for a Subsonic server, serving a catalogue. """
+
+    daemon_threads = True
+
+    def __init__(self, catalogue: Catalogue, password: str = "secret", delay: float = 0):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.catalogue = catalogue
+        self.password = password
+        self.delay = delay
+        self.requests = 0
+        # The requests to each endpoint, and the ID asked for by every request and by those signed wrongly
+        self.pages = Counter()
+        self.ids: List[str] = []
+        self.rejected: List[str] = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
@@ -38,6 +38,8 @@ parser.add_option("--verbose", action="store_true", dest="verbose", default=Fals
 parser.add_option("--vlc-location", action="store", dest="player", default=None, help="Location of VLC binary.")
 parser.add_option("--config-path", '-c', action="store", dest="path", default=None,
                   help="Use the specified directory for configuration and library files")
+parser.add_option("--fast-start", action="store_true", dest="fast_start", default=False,
+                  help="Start with the saved libraries and update them in the background")
 
 # pysonic.options, parse 'em
 (pysonic.options, cmd_input) = parser.parse_args()
@@ -52,7 +54,7 @@ else:
 if pysonic.options.path:
     pysonic.state.root_dir = pysonic.options.path
 
-with PysonicContext():
+with PysonicContext(fast_start=pysonic.options.fast_start):
     # Connect to the VLC interface
     pysonic.state.vlc = pysonic.VLCInterface()
 
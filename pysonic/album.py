@@ -1,38 +1,49 @@
 import sys
-from typing import Iterable
+from typing import Iterable, List
 
 import pysonic
 import pysonic.utils as utils
 
+# The album attributes that are kept; the rest of what the server sends is dropped
+ALBUM_FIELDS = ('id', 'name', 'artist', 'artistId', 'songCount', 'duration', 'created', 'changed', 'year')
+
 
 class Album(object):
     """This class implements the logical concept of an album. """
 
-    data_dict = None
-    songs = []
+    __slots__ = ('server', 'data_dict', 'songs')
 
-    def __init__(self, data_dict, server: 'pysonic.Server' = None):
-        """We need the dictionary to create an album. """
+    def __init__(self, data_dict, server: 'pysonic.Server' = None, songs: List[dict] = None):
+        """We need the dictionary to create an album. The song dictionaries
+        are fetched from the server unless they are provided. """
 
         self.songs = []
         self.server = server
         if data_dict:
-            self.data_dict = data_dict
-            songs = self.server.sub_request(page="getAlbum",
-                                            list_type='song',
-                                            extras={'id': self.data_dict['id']})
+            self.data_dict = utils.compact(data_dict, ALBUM_FIELDS, unique=('id',))
+            if songs is None:
+                songs = [x.attrib for x in self.server.sub_request(page="getAlbum",
+                                                                   list_type='song',
+                                                                   extras={'id': self.data_dict['id']})]
 
             # Sort the songs by track number and disk
-            songs.sort(key=lambda k: (int(k.attrib.get('discNumber', sys.maxsize)), int(k.attrib.get('track', sys.maxsize))))
+            songs = sorted(songs, key=lambda k: (int(k.get('discNumber', sys.maxsize)), int(k.get('track', sys.maxsize))))
 
-            if not server.library.initialized:
-                sys.stdout.write('.')
-                sys.stdout.flush()
+            if server.library.progress is not None:
+                server.library.progress.advance()
             for one_song in songs:
-                self.songs.append(pysonic.Song(one_song.attrib, server=self.server))
+                self.songs.append(pysonic.Song(one_song, server=self.server))
         else:
             raise ValueError('You must pass the album dictionary to create an album.')
 
+    def __setstate__(self, state: dict) -> None:
+        # Albums pickled by older versions have an instance dictionary rather than slots
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self.server = state.get('server')
+        self.data_dict = utils.compact(state['data_dict'], ALBUM_FIELDS, unique=('id',))
+        self.songs = state.get('songs', [])
+
     def update_server(self, server: 'pysonic.Server') -> None:
         """Update the server this album is linked to. """
         self.server = server
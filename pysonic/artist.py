@@ -1,20 +1,27 @@
+from concurrent.futures import Executor
 from typing import Iterable
 
 import pysonic
 import pysonic.utils as utils
 
+# The artist attributes that are kept; the rest of what the server sends is dropped
+ARTIST_FIELDS = ('id', 'name', 'albumCount')
+
 
 class Artist(object):
     """This class implements the logical concept of an artist. """
 
-    data_dict = None
-    albums = []
+    __slots__ = ('server', 'data_dict', 'albums')
 
-    def add_albums(self, albums: 'pysonic.album') -> None:
-        """Add any number of albums to the artist. """
+    def add_albums(self, albums: 'pysonic.album', executor: Executor = None) -> None:
+        """Add any number of albums to the artist. If an executor is
+        provided the albums are fetched concurrently. """
 
-        for one_album in albums:
-            self.albums.append(pysonic.Album(one_album.attrib, server=self.server))
+        if executor is None:
+            for one_album in albums:
+                self.albums.append(pysonic.Album(one_album.attrib, server=self.server))
+        else:
+            self.albums.extend(executor.map(lambda x: pysonic.Album(x.attrib, server=self.server), albums))
 
     def update_server(self, server: 'pysonic.Server') -> None:
         """Update the server this artist is linked to. """
@@ -23,13 +30,18 @@ class Artist(object):
         for one_album in self.albums:
             one_album.update_server(server)
 
-    def __init__(self, artist_id: str = None, server: 'pysonic.Server' = None):
-        """We need the dictionary to create an artist. """
+    def __init__(self, artist_id: str = None, server: 'pysonic.Server' = None, executor: Executor = None,
+                 data_dict: dict = None):
+        """We need the dictionary to create an artist. It is fetched from the
+        server along with the albums, unless it is provided, in which case
+        the caller adds the albums. """
 
         self.albums = []
         self.server = server
 
-        if artist_id is not None:
+        if data_dict is not None:
+            self.data_dict = utils.compact(data_dict, ARTIST_FIELDS, unique=('id',))
+        elif artist_id is not None:
             # Fetch the whole XML tree for this artist
             data_dict = self.server.sub_request(page="getArtist",
                                                 list_type='album',
@@ -40,16 +52,28 @@ class Artist(object):
                 raise ValueError("Could not get artist data from server.")
 
             if len(data_dict) == 1:
-                self.data_dict = data_dict[0].attrib
-                self.add_albums(list(data_dict[0]))
+                self.data_dict = utils.compact(data_dict[0].attrib, ARTIST_FIELDS, unique=('id',))
+                self.add_albums(list(data_dict[0]), executor=executor)
             else:
                 print(data_dict)
                 raise ValueError('The root you passed includes more than one artist.')
-            # Sort the albums by ID
-            self.albums.sort(key=lambda k: int(k.data_dict.get('id', '0')))
+            self.sort_albums()
         else:
             raise ValueError('You must pass the artist dictionary to create an artist.')
 
+    def __setstate__(self, state: dict) -> None:
+        # Artists pickled by older versions have an instance dictionary rather than slots
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self.server = state.get('server')
+        self.data_dict = utils.compact(state['data_dict'], ARTIST_FIELDS, unique=('id',))
+        self.albums = state.get('albums', [])
+
+    def sort_albums(self) -> None:
+        """Sort the albums by ID. """
+
+        self.albums.sort(key=lambda k: int(k.data_dict.get('id', '0')))
+
     def __repr__(self) -> str:
         return f"Artist(name='{self.data_dict.get('name')}', id={self.data_dict.get('id')})"
 
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# How many seconds a response from each read-only endpoint stays fresh. Endpoints not
+#  listed here are never cached.
+DEFAULT_TTLS = {
+    'getPlaylists': 60,
+    'getPlaylist': 60,
+    'getNowPlaying': 5,
+    'getChatMessages': 10,
+    'getSimilarSongs': 300,
+}
+
+# Which cached endpoints go stale when a request is made to a write endpoint
+INVALIDATED_BY = {
+    'addChatMessage': ('getChatMessages',),
+    'createPlaylist': ('getPlaylists', 'getPlaylist'),
+    'updatePlaylist': ('getPlaylists', 'getPlaylist'),
+    'deletePlaylist': ('getPlaylists', 'getPlaylist'),
+}
+
+# Endpoints with these prefixes only read from the server, so identical concurrent
+#  requests to them can safely share one response
+READ_ONLY_PREFIXES = ('get', 'search', 'ping')
+
+
+class ResponseCache(object):
+    """An in-memory cache of parsed server responses. Every entry expires
+    after the time to live of its endpoint, and once max_entries is
+    reached the least recently used entry is evicted. Safe to use from
+    several threads. """
+
+    def __init__(self, ttls: dict = None, max_entries: int = 256):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(page: str, list_type: str, extras: dict, return_root: bool) -> tuple:
+        """Build the cache key for a request. The salt and token differ for
+        every request, so only the request specific parameters are used. """
+
+        return (page.strip(), list_type, return_root,
+                tuple(sorted((str(k), str(v)) for k, v in extras.items())))
+
+    def cacheable(self, page: str) -> bool:
+        """Whether responses from this endpoint are cached at all. """
+
+        return self.ttls.get(page.strip(), 0) > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for a key, or None if there is no fresh
+        value. """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entries if the
+        cache is full. """
+
+        expires = time.monotonic() + self.ttls.get(key[0], 0)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *pages: str) -> None:
+        """Drop the cached responses for the given endpoints, or everything
+        if no endpoints are given. """
+
+        with self._lock:
+            if not pages:
+                self._entries.clear()
+                return
+            for key in [x for x in self._entries if x[0] in pages]:
+                del self._entries[key]
+
+    def invalidate_after(self, page: str) -> None:
+        """Drop whatever a request to the given (write) endpoint made stale. """
+
+        stale = INVALIDATED_BY.get(page.strip())
+        if stale:
+            self.invalidate(*stale)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _Call(object):
+    """One in-flight call that other callers can wait on. """
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Deduplicates concurrent calls. While a call for a key is running,
+    other callers asking for the same key wait for it and share its result
+    (or exception) rather than making the call themselves. """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """Return function(), or the result of an identical call that is
+        already running. """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
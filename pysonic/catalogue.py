@@ -0,0 +1,117 @@
+from typing import Dict, List, Tuple
+
+import pysonic
+from pysonic import index
+
+
+def _text(data_dict: dict, field: str) -> str:
+    return " ".join(index.tokenise(data_dict.get(field) or ""))
+
+
+def item_key(kind: str, item) -> tuple:
+    """Return what makes a song, album or artist the same one on any
+    server: its names with case, accents and punctuation dropped, and the
+    duration of a song. IDs differ between servers, so they are left out. """
+
+    data_dict = item.data_dict
+    if kind == 'songs':
+        return (_text(data_dict, 'artist'), _text(data_dict, 'album'), _text(data_dict, 'title'),
+                data_dict.get('duration'))
+    if kind == 'albums':
+        return _text(data_dict, 'artist'), _text(data_dict, 'name')
+    return _text(data_dict, 'name'),
+
+
+def server_rank(one_server: 'pysonic.Server') -> Tuple[bool, float]:
+    """Sort servers fastest first, by their measured latency, with any not
+    measured yet last. """
+
+    latency = one_server.metrics.latency
+    return latency is None, latency or 0.0
+
+
+class CatalogueEntry(object):
+    """One song, album or artist, with its copy on each server that has
+    it, its best score on any of them, and the copy on the fastest server
+    to be played from. """
+
+    __slots__ = ('copies', 'score', 'preferred')
+
+    def __init__(self):
+        self.copies = []
+        self.score = None
+        self.preferred = None
+
+    @property
+    def source(self) -> str:
+        """The name of the preferred server, and how many others have it. """
+
+        preferred = self.preferred.server.server_name
+        if len(self.copies) > 1:
+            return f"{preferred}+{len(self.copies) - 1}"
+        return preferred
+
+
+def merge(kind: str, search: str = None) -> Tuple[List[CatalogueEntry], bool]:
+    """Search every enabled server, and merge the results that are the
+    same item into one entry, through a hash of their keys. Return the
+    entries best first, and whether the search was fuzzy on any server.
+    Word and fuzzy matches are both scored from 0 to 1, so they rank
+    together. """
+
+    entries: Dict[tuple, CatalogueEntry] = {}
+    fuzzy = False
+    for one_server in pysonic.state.enabled_servers:
+        res, scores, was_fuzzy = one_server.library.find(kind, search)
+        fuzzy = fuzzy or was_fuzzy
+        for position, item in enumerate(res):
+            entry = entries.get(item_key(kind, item))
+            if entry is None:
+                entry = entries[item_key(kind, item)] = CatalogueEntry()
+            entry.copies.append(item)
+            if scores is not None and (entry.score is None or scores[position] > entry.score):
+                entry.score = scores[position]
+
+    ranks = {x: server_rank(x) for x in pysonic.state.enabled_servers}
+    for entry in entries.values():
+        entry.preferred = min(entry.copies, key=lambda x: ranks[x.server])
+    # A stable sort, so that equal scores keep the order of the servers and of their results
+    ranked = sorted(entries.values(), key=lambda x: -(x.score or 0))
+
+    # The servers share the results, which are played once in this order, each from its preferred server
+    results = [x.preferred for x in ranked]
+    for one_server in pysonic.state.enabled_servers:
+        one_server.library.prev_res = results
+    return ranked, fuzzy
+
+
+def _score(entry: CatalogueEntry, fuzzy: bool) -> str:
+    return "%3d%% " % round(entry.score * 100) if fuzzy else ""
+
+
+def search_songs(search: str = None) -> None:
+    """Print the songs matching the query on any enabled server. """
+
+    ranked, fuzzy = merge('songs', search)
+    pysonic.print_song_list([x.preferred for x in ranked], [x.score for x in ranked] if fuzzy else None,
+                            sources=[x.source for x in ranked])
+
+
+def search_albums(search: str = None) -> None:
+    """Print the albums matching the query on any enabled server. """
+
+    ranked, fuzzy = merge('albums', search)
+    if not ranked:
+        print("No albums matched your query.")
+    for entry in ranked:
+        print(f"{_score(entry, fuzzy)}{entry.preferred.recursive_str(0)} [{entry.source}]")
+
+
+def search_artists(search: str = None) -> None:
+    """Print the artists matching the query on any enabled server. """
+
+    ranked, fuzzy = merge('artists', search)
+    if not ranked:
+        print("No artists matched your query.")
+    for entry in ranked:
+        print(f"{_score(entry, fuzzy)}{entry.preferred.recursive_str(0)} [{entry.source}]")
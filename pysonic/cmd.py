@@ -1,8 +1,8 @@
 import cmd
-import os
 import sys
 
 import pysonic
+import pysonic.catalogue as catalogue
 import pysonic.commands as commands
 import pysonic.utils as utils
 
@@ -12,12 +12,20 @@ class PysonicShell(cmd.Cmd):
     prompt = ':'
 
     def do_artist(self, arg):
-        """artist [ID|query] - display artists matching ID or query"""
+        """artist [ID|query|~query|"text"] - display artists matching ID or query,
+        those closest to a misspelled ~query, or those whose name contains "text"."""
+        if commands.merging():
+            catalogue.search_artists(arg)
+            return
         for one_server in utils.iter_servers():
             one_server.library.search_artists(arg)
 
     def do_album(self, arg):
-        """album [ID|query] - displays albums matching ID or query."""
+        """album [ID|query|~query|"text"] - displays albums matching ID or query,
+        those closest to a misspelled ~query, or those whose name contains "text"."""
+        if commands.merging():
+            catalogue.search_albums(arg)
+            return
         for one_server in utils.iter_servers():
             one_server.library.search_albums(arg)
 
@@ -27,7 +35,11 @@ class PysonicShell(cmd.Cmd):
             one_folder.library.search_folders(arg)
 
     def do_song(self, arg):
-        """song [ID|query] - display songs matching ID or query."""
+        """song [ID|query|~query|"text"] - display songs matching ID or query,
+        those closest to a misspelled ~query, or those whose name contains "text"."""
+        if commands.merging():
+            catalogue.search_songs(arg)
+            return
         for one_server in utils.iter_servers():
             one_server.library.search_songs(arg)
 
@@ -39,10 +51,16 @@ class PysonicShell(cmd.Cmd):
     def do_rebuild(self, _):
         """rebuild - rebuild the library for any active servers."""
         for one_server in utils.iter_servers():
-            os.unlink(utils.get_home(one_server.pickle_file))
+            one_server.delete_library()
             one_server.library.initialized = False
             one_server.go_online()
 
+    def do_refresh(self, _):
+        """refresh - fetch the folders changed on the server for any active
+        servers, keeping the unchanged ones."""
+        for one_server in utils.iter_servers():
+            one_server.refresh_folder()
+
     def do_new(self, arg):
         """new [num_results] - prints new albums added to the server."""
         for one_server in utils.iter_servers():
@@ -58,6 +76,12 @@ class PysonicShell(cmd.Cmd):
         the specified song."""
         commands.get_similar(arg)
 
+    def do_merge(self, arg):
+        """merge [on|off] - show one catalogue merged across the active
+        servers for artist, album and song searches, with each result
+        played from the fastest server that has it."""
+        commands.set_merged(arg)
+
     def do_server(self, arg):
         """server - switch active servers. Run with no args for help."""
         commands.choose_server(arg)
@@ -70,6 +94,11 @@ class PysonicShell(cmd.Cmd):
         """now - shows who is currently listening to what on subsonic."""
         commands.now_playing()
 
+    def do_stats(self, _):
+        """stats - shows request statistics for each server and endpoint,
+        and the latest changes to the request limit."""
+        commands.print_stats()
+
     def do_pause(self, _):
         """pause - pause the music"""
         pysonic.state.vlc.write("pause")
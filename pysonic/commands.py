@@ -1,12 +1,14 @@
 import getpass
 import os
-import sys
 import tempfile
 import time
 
 import pysonic
 from pysonic import utils as utils
 
+# How many of the latest changes to the request limit the stats command shows
+LIMIT_CHANGES_SHOWN = 5
+
 
 def print_messages():
     """Get chat messages. """
@@ -17,9 +19,8 @@ def print_messages():
         # Convert time from unix time to readable time
         for message in messages:
             mtime = time.ctime(float(message.attrib['time']) / 1000).rstrip()
-            message.attrib['time'] = mtime
             print("   At %s %s wrote %s." %
-                  (message.attrib.get('time', '?'),
+                  (mtime,
                    message.attrib.get('username', '?'),
                    message.attrib.get('message', '?')))
 
@@ -44,13 +45,15 @@ def add_server():
     bitrate = input("Max bitrate (enter 0 to stream raw or press enter to use default value): ")
     enabled = user_input_maps.get(input("Enabled (y/n): ").lower(), True)
     scrobble = user_input_maps.get(input("Scrobble (y/n): ").lower(), False)
+    workers = input("Parallel requests when building the library (press enter to use 1): ")
+    if not workers.isdigit():
+        workers = 1
 
     cur_server = pysonic.Server(len(pysonic.state.all_servers), server_name, user_name,
-                                password, server_url, enabled, bitrate, scrobble)
+                                password, server_url, enabled, bitrate, scrobble, int(workers))
     pysonic.state.all_servers.append(cur_server)
     if enabled:
-        sys.stdout.write("Initializing server " + cur_server.server_name + ": ")
-        sys.stdout.flush()
+        print("Initializing server " + cur_server.server_name + ".")
         cur_server.go_online()
         if cur_server.online:
             pysonic.state.enabled_servers.append(cur_server)
@@ -74,7 +77,12 @@ def play_previous(play=False):
 
     # Get the play string
     playlist = ""
+    played = set()
     for one_server in pysonic.state.enabled_servers:
+        # After a merged search the servers share one list of results, which is played once
+        if id(one_server.library.prev_res) in played:
+            continue
+        played.add(id(one_server.library.prev_res))
         res = one_server.library.play_string()
         results += res[1]
         playlist += res[0]
@@ -155,7 +163,12 @@ def booklet():
 def print_previous():
     """Print off whatever the saved result is. """
 
+    printed = set()
     for one_server in utils.iter_servers():
+        # After a merged search the servers share one list of results, which is printed once
+        if id(one_server.library.prev_res) in printed:
+            continue
+        printed.add(id(one_server.library.prev_res))
         if (not one_server.library.prev_res or
                 len(one_server.library.prev_res) == 0):
             print("No saved result.")
@@ -164,6 +177,25 @@ def print_previous():
                 print(item.recursive_str(level=1, indentations=0))
 
 
+def merging():
+    """Whether searches should show one catalogue merged across servers. """
+
+    return pysonic.state.merged and len(pysonic.state.enabled_servers) > 1
+
+
+def set_merged(query=None):
+    """Turn the merged catalogue on or off, or show whether it is on. """
+
+    if query in ("on", "off"):
+        pysonic.state.merged = query == "on"
+    elif query:
+        print("Usage: merge [on|off]")
+        return
+    print("Merged catalogue: %s" % ("on" if pysonic.state.merged else "off"))
+    if pysonic.state.merged and len(pysonic.state.enabled_servers) < 2:
+        print("Only one server is active, so there is nothing to merge.")
+
+
 def choose_server(query=None):
     """Choose whether to display one server or all servers. """
 
@@ -229,6 +261,21 @@ def now_playing():
             one_server.library.get_song_by_id(one_person.attrib['id'])
 
 
+def print_stats():
+    """Print the request statistics of the active servers. """
+
+    for one_server in utils.iter_servers():
+        metrics = one_server.metrics
+        elapsed = time.monotonic() - metrics.started
+        print(metrics)
+        print(f"{metrics.requests} requests, {metrics.bytes / 1024:.1f} KB received in {elapsed:.0f}s. "
+              f"{one_server.coalesced_requests} requests coalesced, {len(one_server.cache)} responses cached. "
+              f"Allowing {int(one_server.limiter.limit)} of up to {one_server.limiter.max_limit} concurrent requests.")
+        for change in list(one_server.limiter.history)[-LIMIT_CHANGES_SHOWN:]:
+            print(f"   {time.strftime('%H:%M:%S', time.localtime(change.when))} limit {change.old_limit} -> "
+                  f"{change.new_limit} after {change.reason}")
+
+
 def get_now_playing():
     """ Returns the song that is currently playing. """
 
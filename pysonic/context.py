@@ -2,6 +2,7 @@ import configparser
 import os
 import readline
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from traceback import print_tb, print_exception
 
 from filelock import FileLock, Timeout
@@ -12,7 +13,8 @@ import pysonic.utils as utils
 
 
 class PysonicContext:
-    def __init__(self, path: str = None):
+    def __init__(self, path: str = None, fast_start: bool = False):
+        self.fast_start = fast_start
         if path:
             pysonic.state.root_dir = path
         path = utils.get_home()
@@ -37,22 +39,76 @@ class PysonicContext:
             except configparser.NoOptionError:
                 scrobble_plays = False
 
+            try:
+                workers = config.getint(each_server, 'workers')
+            except configparser.NoOptionError:
+                workers = 1
+
+            try:
+                response_format = config.get(each_server, 'format')
+            except configparser.NoOptionError:
+                response_format = "xml"
+
+            try:
+                token_reuse = config.getint(each_server, 'tokenreuse')
+            except configparser.NoOptionError:
+                token_reuse = 0
+
+            try:
+                build_strategy = config.get(each_server, 'buildstrategy')
+            except configparser.NoOptionError:
+                build_strategy = "artist"
+
+            try:
+                max_rps = config.getfloat(each_server, 'maxrps')
+            except configparser.NoOptionError:
+                max_rps = 0
+
+            try:
+                max_workers = config.getint(each_server, 'maxworkers')
+            except configparser.NoOptionError:
+                max_workers = 0
+
+            try:
+                storage = config.get(each_server, 'storage')
+            except configparser.NoOptionError:
+                storage = "snapshot"
+
+            try:
+                compress = config.getboolean(each_server, 'compress')
+            except configparser.NoOptionError:
+                compress = False
+
             new_server = pysonic.Server(len(pysonic.state.all_servers), each_server,
                                         config.get(each_server, 'username'),
                                         config.get(each_server, 'password'),
                                         config.get(each_server, 'host'),
                                         enabled=config.getboolean(each_server, 'enabled'),
                                         bitrate=config.get(each_server, 'bitrate'),
-                                        scrobble=scrobble_plays)
+                                        scrobble=scrobble_plays,
+                                        workers=workers,
+                                        response_format=response_format,
+                                        token_reuse=token_reuse,
+                                        build_strategy=build_strategy,
+                                        max_rps=max_rps,
+                                        max_workers=max_workers,
+                                        storage=storage,
+                                        compress=compress)
             pysonic.state.all_servers.append(new_server)
 
             if new_server.enabled:
-                sys.stdout.write("Loading server " + new_server.server_name + ": ")
-                sys.stdout.flush()
-                new_server.go_online()
+                # Ask for any passwords up front, as the servers go online in parallel
+                new_server.ask_password()
             else:
                 print("Loading server " + new_server.server_name + ": Disabled.")
 
+        # Bring every enabled server online at once, so startup takes as long as the slowest one
+        to_load = [x for x in pysonic.state.all_servers if x.enabled]
+        if to_load:
+            with ThreadPoolExecutor(max_workers=len(to_load)) as loader:
+                for loading in [loader.submit(x.go_online, self.fast_start) for x in to_load]:
+                    loading.result()
+
         # Create our list of active servers
         for each_server in pysonic.state.all_servers:
             if each_server.enabled and each_server.online:
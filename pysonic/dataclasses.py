@@ -11,3 +11,13 @@ class State:
     all_servers: List['pysonic.Server'] = field(default_factory=list)
     cols: int = 80
     root_dir: str = None
+    # Whether searches show one catalogue merged across the enabled servers
+    merged: bool = False
+
+
+@dataclass
+class LimitAdjustment:
+    when: float
+    old_limit: int
+    new_limit: int
+    reason: str
@@ -1,8 +1,18 @@
-from functools import cached_property
-from typing import List, Iterable
+import json
+import os
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, IO, List, Iterable, Optional, Tuple
 
 import pysonic
 import pysonic.utils as utils
+from pysonic.index import normalise
+from pysonic.metrics import BuildProgress
+
+# A directory whose server timestamp in this attribute differs from before is fetched again. Only changes to the
+#  directory itself move it, and 'created' never does, so a directory without it is always fetched again.
+FOLDER_CHANGE_FIELD = 'changed'
 
 
 class Folder(object):
@@ -12,45 +22,51 @@ class Folder(object):
     children = []
     songs = []
 
-    def __init__(self, server: 'pysonic.Server' = None, folder_id: str = None, data_dict: dict = None):
+    def __init__(self, server: 'pysonic.Server' = None, folder_id: str = None, data_dict: dict = None,
+                 children: List['pysonic.Folder'] = None, songs: List['pysonic.Song'] = None):
         """Create a folder hierarchy. Recursively calls itself with
-        fold_id set to build the tree. """
+        fold_id set to build the tree. If the children are given, the
+        folder is created from them and nothing is fetched. """
 
         self.children = []
         self.songs = []
         self.data_dict = data_dict
         self.server = server
 
-        if folder_id:
-            children = self.server.sub_request(page="getMusicDirectory ", list_type='child', extras={'id': folder_id})
+        if children is not None:
+            self.children = children
+            self.songs = songs or []
+        elif folder_id:
+            # Only the attributes are needed, so don't hold the parsed response in memory
+            children = [x.attrib for x in self.server.sub_request(page="getMusicDirectory ", list_type='child',
+                                                                  extras={'id': folder_id}, incremental=True)]
             for child in children:
-                if (child.attrib['isDir'] == "true" and
-                        child.attrib['title'][-5:] != ".flac" and
-                        child.attrib['title'][-4:] != ".mp3"):
+                if (child['isDir'] == "true" and
+                        child['title'][-5:] != ".flac" and
+                        child['title'][-4:] != ".mp3"):
                     print("Found directory: %s" %
-                          child.attrib['title'][0:utils.get_width(17)])
+                          child['title'][0:utils.get_width(17)])
                     self.children.append(Folder(server=self.server,
-                                                folder_id=child.attrib['id'],
-                                                data_dict=child.attrib))
+                                                folder_id=child['id'],
+                                                data_dict=child))
 
-                elif child.attrib['isDir'] == "true":
-                    print("Skipping (subsonic bug): %s" % child.attrib['title'][0:utils.get_width(25)])
+                elif child['isDir'] == "true":
+                    print("Skipping (subsonic bug): %s" % child['title'][0:utils.get_width(25)])
                 else:
-                    if child.attrib['id'] in self.server.library.song_ids:
-                        song_id = child.attrib['id']
-                        song = self.server.library.get_song_by_id(song_id)
+                    song = self.server.library.get_song_by_id(child['id'], remember=False)
+                    if song is not None:
                         self.songs.append(song)
                     else:
                         print("Found new song: %s" %
-                              child.attrib['title'][0:utils.get_width(16)])
-                        self.songs.append(pysonic.Song(child.attrib, server=self.server))
+                              child['title'][0:utils.get_width(16)])
+                        self.songs.append(pysonic.Song(child, server=self.server))
         else:
-            server.library.update_ids()
-            folders = self.server.sub_request(page="getIndexes", list_type='artist')
+            folders = [x.attrib for x in self.server.sub_request(page="getIndexes", list_type='artist',
+                                                                 incremental=True)]
             for one_folder in folders:
                 self.children.append(Folder(server=self.server,
-                                            folder_id=one_folder.attrib['id'],
-                                            data_dict=one_folder.attrib))
+                                            folder_id=one_folder['id'],
+                                            data_dict=one_folder))
 
     def play_string(self) -> str:
         """Return the needed playlist data. """
@@ -93,15 +109,17 @@ class Folder(object):
                 res += "\n" + one_song.recursive_str(level - 1, indentations + 1)
         return res
 
-    @cached_property
+    @property
     def get_subfolders(self) -> List['pysonic.Folder']:
-        """ Get any subfolders from this folder. """
+        """ Get any subfolders from this folder, each followed by its own. """
 
         folder_list = []
-        for child in self.children:
+        pending = list(reversed(self.children))
+        while pending:
+            child = pending.pop()
             if child is not None:
                 folder_list.append(child)
-                folder_list.extend(child.get_subfolders)
+                pending.extend(reversed(child.children))
         return folder_list
 
     # Implement expected methods
@@ -113,3 +131,270 @@ class Folder(object):
 
     def __str__(self) -> str:
         return self.recursive_str(1)
+
+
+def folder_name(one_folder: Folder) -> str:
+    """Return the title of a folder, or its name if it has no title. """
+
+    return one_folder.data_dict.get('title') or one_folder.data_dict.get('name') or "?"
+
+
+class FolderIndex(object):
+    """A flat index of a folder hierarchy, for searching it without walking
+    the tree. The folders are numbered in the order get_subfolders gives
+    them, so a folder's parent always comes before it. For each folder the
+    index holds the position of its parent, the number of songs in it and
+    everything under it, and its normalised name, with all the names kept
+    in one string separated by newlines. """
+
+    def __init__(self, root: Folder):
+        self.folders: List[Folder] = []
+        # -1 for the top level folders
+        self.parents = array('i')
+        self.song_counts = array('I')
+        # The position of each folder ID, the first if it appears more than once
+        self.positions: Dict[str, int] = {}
+
+        names = []
+        pending = [(x, -1) for x in reversed(root.children)]
+        while pending:
+            one_folder, parent = pending.pop()
+            position = len(self.folders)
+            self.folders.append(one_folder)
+            self.parents.append(parent)
+            self.song_counts.append(len(one_folder.songs))
+            self.positions.setdefault(one_folder.data_dict['id'], position)
+            names.append(normalise(folder_name(one_folder)).replace("\n", " "))
+            pending.extend((x, position) for x in reversed(one_folder.children))
+        self.names = "\n".join(names)
+
+        # Children come after their parents, so going backwards adds up each subtree before its parent needs it
+        for position in range(len(self.folders) - 1, -1, -1):
+            if self.parents[position] >= 0:
+                self.song_counts[self.parents[position]] += self.song_counts[position]
+
+    def __len__(self) -> int:
+        return len(self.folders)
+
+    def find(self, folder_id: str) -> Optional[int]:
+        """Return the position of the folder with the ID, or None. """
+
+        return self.positions.get(folder_id)
+
+    def search(self, query: str) -> List[int]:
+        """Return the positions of the folders whose names contain the
+        query, in order. """
+
+        query = normalise(query).replace("\n", " ")
+        res = []
+        position = 0
+        counted = 0
+        offset = self.names.find(query)
+        while offset != -1:
+            # Names are separated by newlines, so the newlines before the match give its position
+            position += self.names.count("\n", counted, offset)
+            res.append(position)
+            # Carry on from the end of the name, so that each folder is only found once
+            counted = self.names.find("\n", offset + len(query))
+            if counted == -1:
+                break
+            offset = self.names.find(query, counted)
+        return res
+
+    def path(self, position: int) -> List[Folder]:
+        """Return the folders from the top level down to the folder at the
+        position, including it. """
+
+        res = []
+        while position >= 0:
+            res.append(self.folders[position])
+            position = self.parents[position]
+        res.reverse()
+        return res
+
+
+def _line(entry: dict) -> bytes:
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n"
+
+
+class FolderCrawl(object):
+    """Builds the same folder hierarchy as Folder, but breadth first, with
+    the directories fetched by a pool of the server's workers. Every
+    fetched directory is appended to a checkpoint file, so an interrupted
+    crawl carries on where it stopped the next time it is run.
+
+    Given the previous hierarchy, the directories without subdirectories
+    whose timestamp didn't change on the server are kept as they were, and
+    everything else is fetched again. A directory's timestamp doesn't cover
+    changes further down, so directories with subdirectories are always
+    fetched, for the timestamps of their subdirectories to be compared.
+    Songs are taken from the library if it has them. """
+
+    def __init__(self, server: 'pysonic.Server', previous: Folder = None, library: 'pysonic.Library' = None):
+        self.server = server
+        self.library = server.library if library is None else library
+        self.path = server.crawl_file
+        # The top level folders, and the subdirectories and songs of each fetched directory by ID
+        self.roots: Optional[List[dict]] = None
+        self.fetched: Dict[str, Tuple[List[dict], List[dict]]] = {}
+        # The folders of the previous hierarchy by ID, and how many directories were kept or fetched
+        self.previous: Dict[str, Folder] = {}
+        self.skipped = 0
+        self.refetched = 0
+
+        if previous is not None:
+            stack = list(previous.children)
+            while stack:
+                one_folder = stack.pop()
+                known = self.previous.get(one_folder.data_dict['id'])
+                # A directory that shows up more than once only has its contents in one place
+                if known is None or not (known.children or known.songs):
+                    self.previous[one_folder.data_dict['id']] = one_folder
+                stack.extend(one_folder.children)
+
+    def _unchanged(self, data_dict: dict) -> bool:
+        """Whether the directory is in the previous hierarchy without
+        subdirectories and with the same timestamp. Directories the server
+        gives no timestamp for are always fetched. """
+
+        known = self.previous.get(data_dict['id'])
+        return (known is not None and not known.children and data_dict.get(FOLDER_CHANGE_FIELD) is not None and
+                data_dict[FOLDER_CHANGE_FIELD] == known.data_dict.get(FOLDER_CHANGE_FIELD))
+
+    def _load(self) -> None:
+        """Read the checkpoint of an interrupted crawl, if there is one. """
+
+        try:
+            with open(self.path, "rb") as checkpoint:
+                lines = checkpoint.read().split(b"\n")
+        except FileNotFoundError:
+            return
+        # The last line is empty, or was cut short when the crawl was interrupted
+        for line in lines[:-1]:
+            entry = json.loads(line)
+            if 'roots' in entry:
+                self.roots = entry['roots']
+            else:
+                self.fetched[entry['id']] = (entry['dirs'], entry['songs'])
+
+    def _fetch(self, folder_id: str) -> Tuple[List[dict], List[dict]]:
+        """Return the subdirectories and songs of a directory. """
+
+        dirs, songs = [], []
+        for child in self.server.sub_request(page="getMusicDirectory ", list_type='child', extras={'id': folder_id},
+                                             incremental=True):
+            child = child.attrib
+            if child['isDir'] == "true" and child['title'][-5:] != ".flac" and child['title'][-4:] != ".mp3":
+                dirs.append(child)
+            elif child['isDir'] == "true":
+                print("Skipping (subsonic bug): %s" % child['title'][0:utils.get_width(25)])
+            else:
+                songs.append(child)
+        return dirs, songs
+
+    def run(self, verbose: bool = True) -> Folder:
+        """Crawl whatever is left to crawl, and return the root folder.
+        Show the progress if verbose. """
+
+        with self.server.crawl_lock:
+            self._load()
+            if self.fetched and verbose:
+                print(f"Resuming the folder crawl for {self.server.server_name}, "
+                      f"{len(self.fetched)} directories were already fetched.")
+
+            with open(self.path, "a+b") as checkpoint:
+                # Drop the end of an entry cut short by an interruption, so that it doesn't run into the next one
+                if checkpoint.tell():
+                    checkpoint.seek(-1, os.SEEK_END)
+                    if checkpoint.read(1) != b"\n":
+                        checkpoint.seek(0)
+                        checkpoint.truncate(checkpoint.read().rfind(b"\n") + 1)
+                if self.roots is None:
+                    self.roots = [x.attrib for x in self.server.sub_request(page="getIndexes", list_type='artist',
+                                                                             incremental=True)]
+                    checkpoint.write(_line({'roots': self.roots}))
+                self._crawl(checkpoint, verbose)
+
+            root = self._assemble()
+            os.unlink(self.path)
+        return root
+
+    def _crawl(self, checkpoint: IO[bytes], verbose: bool) -> None:
+        """Fetch the directories that aren't fetched yet, appending each to
+        the checkpoint. """
+
+        # Queue the directories that are known of but not fetched yet, in breadth first order
+        pending = deque()
+        seen = set()
+        queue = deque(self.roots)
+        while queue:
+            data_dict = queue.popleft()
+            if data_dict['id'] in seen:
+                continue
+            seen.add(data_dict['id'])
+            if data_dict['id'] in self.fetched:
+                queue.extend(self.fetched[data_dict['id']][0])
+            elif not self._unchanged(data_dict):
+                pending.append(data_dict['id'])
+
+        progress = None
+        if verbose:
+            progress = BuildProgress(self.server, len(self.fetched) + len(pending), unit="directories")
+            progress.done = len(self.fetched)
+        try:
+            with ThreadPoolExecutor(max_workers=self.server.limiter.max_limit) as pool:
+                running = {}
+                while pending or running:
+                    while pending and len(running) < self.server.limiter.max_limit:
+                        folder_id = pending.popleft()
+                        running[pool.submit(self._fetch, folder_id)] = folder_id
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        folder_id = running.pop(future)
+                        dirs, songs = future.result()
+                        self.fetched[folder_id] = (dirs, songs)
+                        checkpoint.write(_line({'id': folder_id, 'dirs': dirs, 'songs': songs}))
+                        for child in dirs:
+                            if child['id'] not in seen:
+                                seen.add(child['id'])
+                                if not self._unchanged(child):
+                                    pending.append(child['id'])
+                                    if progress is not None:
+                                        progress.total += 1
+                        if progress is not None:
+                            progress.advance()
+                    checkpoint.flush()
+        finally:
+            if progress is not None:
+                progress.finish()
+
+    def _assemble(self) -> Folder:
+        """Build the folder hierarchy from the fetched directories and the
+        unchanged folders of the previous hierarchy. """
+
+        library = self.library
+        self.refetched = len(self.fetched)
+
+        def make_folder(data_dict: dict) -> Folder:
+            if data_dict['id'] in self.fetched:
+                dirs, songs = self.fetched.pop(data_dict['id'])
+            elif data_dict['id'] in self.previous:
+                one_folder = self.previous.pop(data_dict['id'])
+                one_folder.data_dict = data_dict
+                self.skipped += 1
+                return one_folder
+            else:
+                # A directory that shows up more than once only has its contents in the first place
+                dirs, songs = [], []
+            songs = [library.get_song_by_id(x['id'], remember=False) or pysonic.Song(x, server=self.server)
+                     for x in songs]
+            one_folder = Folder(server=self.server, data_dict=data_dict, children=[], songs=songs)
+            pending.append((one_folder, dirs))
+            return one_folder
+
+        pending = []
+        root = Folder(server=self.server, children=[make_folder(x) for x in self.roots])
+        while pending:
+            one_folder, dirs = pending.pop()
+            one_folder.children.extend(make_folder(x) for x in dirs)
+        return root
@@ -0,0 +1,256 @@
+import os
+import pickle
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from heapq import nlargest
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Bump the version whenever the layout or the normalisation changes; older files are then rebuilt
+VERSION = 1
+
+# The fields indexed for each kind of item, and how much a word in each counts towards the score
+WEIGHTS = {'songs': {'title': 3, 'artist': 2, 'album': 2, 'genre': 1},
+           'albums': {'name': 3, 'artist': 2},
+           'artists': {'name': 3}}
+
+# A query word that is a whole word of the item counts this much more than one that is only a prefix
+EXACT_BONUS = 2
+
+# How alike two words must be, by the share of their trigrams in common, for one to stand in for the other
+MIN_SIMILARITY = 0.4
+
+# How many known words a misspelled query word may stand for, and how many fuzzy results to return
+CLOSE_WORDS = 5
+FUZZY_RESULTS = 10
+
+_WORD = re.compile(r"\w+")
+
+
+def normalise(text: str) -> str:
+    """ Fold case and strip accents, so that 'Beyoncé' matches 'BEYONCE'. """
+
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return "".join(x for x in decomposed if not unicodedata.combining(x)).casefold()
+
+
+def tokenise(text: str) -> List[str]:
+    """ Split text into normalised words. """
+
+    return _WORD.findall(normalise(text))
+
+
+def trigrams(word: str) -> Set[str]:
+    """ Return the three letter pieces of a word, padded so that the start
+    and end of the word count for more. """
+
+    padded = "  " + word + " "
+    return {padded[x:x + 3] for x in range(len(padded) - 2)}
+
+
+class TokenIndex(object):
+    """An inverted index from the words in some fields of items to the IDs
+    of the items. Each query word matches the words it is a prefix of,
+    every query word must match, and results are ranked by the weights
+    of the fields that matched. """
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        # word -> {item ID -> weight of the best field the word is in}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # All the words, sorted for prefix lookups
+        self.words: List[str] = []
+        # trigram -> the words containing it, and word -> how many trigrams it has, built on the first fuzzy search
+        self.grams: Optional[Dict[str, Set[str]]] = None
+        self.gram_counts: Dict[str, int] = {}
+
+    def _item_words(self, data_dict: dict) -> Dict[str, int]:
+        res = {}
+        for field, weight in self.weights.items():
+            for word in tokenise(data_dict.get(field) or ""):
+                if res.get(word, 0) < weight:
+                    res[word] = weight
+        return res
+
+    def add(self, data_dict: dict) -> None:
+        """Add an item to the index. """
+
+        for word, weight in self._item_words(data_dict).items():
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = {}
+                insort(self.words, word)
+                if self.grams is not None:
+                    self._add_grams(word)
+            posting[data_dict['id']] = weight
+
+    def extend(self, data_dicts: Iterable[dict]) -> None:
+        """Add many items to the index, sorting the words once at the end. """
+
+        for data_dict in data_dicts:
+            for word, weight in self._item_words(data_dict).items():
+                self.postings.setdefault(word, {})[data_dict['id']] = weight
+        self.words = sorted(self.postings)
+        self.grams = None
+        self.gram_counts = {}
+
+    def remove(self, data_dict: dict) -> None:
+        """Remove an item from the index. """
+
+        for word in self._item_words(data_dict):
+            posting = self.postings.get(word)
+            if posting is not None:
+                posting.pop(data_dict['id'], None)
+                if not posting:
+                    del self.postings[word]
+                    del self.words[bisect_left(self.words, word)]
+                    if self.grams is not None:
+                        for gram in trigrams(word):
+                            self.grams[gram].discard(word)
+                        del self.gram_counts[word]
+
+    def _words(self, term: str) -> List[str]:
+        """Return the words that start with the term. """
+
+        res = []
+        position = bisect_left(self.words, term)
+        while position < len(self.words) and self.words[position].startswith(term):
+            res.append(self.words[position])
+            position += 1
+        return res
+
+    def _add_grams(self, word: str) -> None:
+        word_grams = trigrams(word)
+        for gram in word_grams:
+            self.grams.setdefault(gram, set()).add(word)
+        self.gram_counts[word] = len(word_grams)
+
+    def _close_words(self, term: str) -> Dict[str, float]:
+        """Return the known words most like the term, with how alike they
+        are from 0 to 1. """
+
+        if self.grams is None:
+            self.grams = {}
+            for word in self.words:
+                self._add_grams(word)
+
+        term_grams = trigrams(term)
+        shared = Counter(chain.from_iterable(self.grams.get(x, ()) for x in term_grams))
+
+        # A word can't be alike enough with fewer trigrams in common than this, whatever its length
+        needed = MIN_SIMILARITY * len(term_grams) / (2 - MIN_SIMILARITY)
+        similarity = {}
+        for word, count in shared.items():
+            if count >= needed:
+                score = 2 * count / (len(term_grams) + self.gram_counts[word])
+                if score >= MIN_SIMILARITY:
+                    similarity[word] = score
+        return dict(nlargest(CLOSE_WORDS, similarity.items(), key=lambda x: x[1]))
+
+    def _matches(self, words: Dict[str, float]) -> Dict[str, float]:
+        """Return the score of every item with one of the words, each word
+        counting for the field it is in times its factor. """
+
+        res = {}
+        for word, factor in words.items():
+            for item_id, weight in self.postings[word].items():
+                if res.get(item_id, 0) < weight * factor:
+                    res[item_id] = weight * factor
+        return res
+
+    def _combine(self, terms: List[Dict[str, float]]) -> Dict[str, float]:
+        """Return the summed scores of the items matching one of the words
+        of every term. """
+
+        sized = sorted(((sum(len(self.postings[x]) for x in words), words) for words in terms),
+                       key=lambda x: x[0])
+        if not sized:
+            return {}
+
+        # Start from the rarest term, so that the candidates only shrink
+        scores = self._matches(sized[0][1])
+        for size, words in sized[1:]:
+            if len(scores) * len(words) < size:
+                # Fewer lookups to check each candidate than to gather everything the term matches
+                narrowed = {}
+                for item_id, score in scores.items():
+                    best = max((self.postings[x].get(item_id, 0) * factor for x, factor in words.items()), default=0)
+                    if best:
+                        narrowed[item_id] = score + best
+                scores = narrowed
+            else:
+                matches = self._matches(words)
+                scores = {item_id: score + matches[item_id] for item_id, score in scores.items()
+                          if item_id in matches}
+        return scores
+
+    def search(self, query: str) -> List[Tuple[str, float]]:
+        """Return the IDs of the items matching every word of the query,
+        with how well they match from 0 to 1, best first. Scores are on the
+        same scale as those of a fuzzy search, so that the two can be
+        ranked together. """
+
+        terms = [{x: EXACT_BONUS if x == term else 1 for x in self._words(term)}
+                 for term in dict.fromkeys(tokenise(query))]
+        most = len(terms) * max(self.weights.values()) * EXACT_BONUS
+        return sorted(((item_id, score / most) for item_id, score in self._combine(terms).items()),
+                      key=lambda x: -x[1])
+
+    def fuzzy_search(self, query: str, limit: int = FUZZY_RESULTS) -> List[Tuple[str, float]]:
+        """Return the IDs of the items most like the query, allowing for
+        misspelled words, with how alike they are from 0 to 1, best first.
+        Query words like no known word are left out, lowering the scores. """
+
+        terms = list(dict.fromkeys(tokenise(query)))
+        close = [x for x in map(self._close_words, terms) if x]
+        if not close:
+            return []
+        most = len(terms) * max(self.weights.values())
+        return nlargest(limit, ((item_id, score / most) for item_id, score in self._combine(close).items()),
+                        key=lambda x: x[1])
+
+
+def build(records: Dict[str, Iterable[dict]]) -> Dict[str, TokenIndex]:
+    """Index the songs, albums and artists given by the attribute
+    dictionaries of each kind. """
+
+    indexes = {kind: TokenIndex(weights) for kind, weights in WEIGHTS.items()}
+    for kind, data_dicts in records.items():
+        indexes[kind].extend(data_dicts)
+    return indexes
+
+
+def save(path: str, indexes: Dict[str, TokenIndex], stamp: Optional[float]) -> None:
+    """Write the indexes to disk. The stamp identifies the saved library
+    they belong to. """
+
+    temp_file = path + ".tmp"
+    with open(temp_file, "wb") as index_file:
+        pickle.dump({'version': VERSION, 'stamp': stamp,
+                     'postings': {kind: x.postings for kind, x in indexes.items()}},
+                    index_file, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_file, path)
+
+
+def load(path: str, stamp: Optional[float]) -> Optional[Dict[str, TokenIndex]]:
+    """Read the indexes from disk, returning None if there are none for
+    the saved library with this stamp. """
+
+    try:
+        with open(path, "rb") as index_file:
+            saved = pickle.load(index_file)
+    except (IOError, EOFError, TypeError, AttributeError, pickle.UnpicklingError):
+        return None
+    if saved.get('version') != VERSION or saved.get('stamp') != stamp or stamp is None:
+        return None
+
+    indexes = {}
+    for kind, weights in WEIGHTS.items():
+        indexes[kind] = TokenIndex(weights)
+        indexes[kind].postings = saved['postings'][kind]
+        indexes[kind].words = sorted(indexes[kind].postings)
+    return indexes
@@ -1,37 +1,175 @@
 import random
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import cached_property
-from typing import List, Optional, Iterable
+from itertools import chain
+from typing import Callable, Dict, List, Optional, Iterable, Tuple, Union
 from urllib.parse import urlencode
 
 import pysonic
+import pysonic.utils as utils
+from pysonic import index
+from pysonic.index import TokenIndex
+from pysonic.metrics import BuildProgress
+
+# How many items to ask for per request when enumerating the whole catalogue
+BULK_PAGE_SIZE = 500
+
+# If any of these artist attributes differ from the server, the artist is updated
+ARTIST_CHANGE_FIELDS = ('name', 'albumCount')
+
+# If any of these album attributes differ from the server, the album is fetched again
+ALBUM_CHANGE_FIELDS = ('name', 'artist', 'songCount', 'duration', 'created', 'changed', 'year')
+
+# The attribute that names each kind of item
+NAME_FIELDS = {'songs': 'title', 'albums': 'name', 'artists': 'name'}
+
+
+def _items(one_artist: Optional['pysonic.Artist']) -> Iterable[Tuple[str, object]]:
+    """Yield the kind and object of an artist and everything on it. """
+
+    if one_artist is not None:
+        yield 'artists', one_artist
+        for one_album in one_artist:
+            yield 'albums', one_album
+            for one_song in one_album:
+                yield 'songs', one_song
 
 
 class Library(object):
-    """This class implements the logical concept of a library. """
+    """This class implements the logical concept of a library. If it is
+    backed by a store, the artists and folders are only read from the
+    store once they are used, and searches and lookups by ID are answered
+    by the store. Changes journaled by the store since it was written are
+    applied over it. """
 
-    artists = []
     initialized = False
+    progress = None
+    store = None
 
-    def __init__(self, server: 'pysonic.Server' = None):
+    def __init__(self, server: 'pysonic.Server' = None,
+                 store: Union['pysonic.snapshot.Snapshot', 'pysonic.store.SQLiteStore'] = None):
         if server is None:
             raise ValueError("You must specify a corresponding server for this library.")
-        self.artists = []
+        self._artists = [] if store is None else None
+        self._folder = None
+        self._folder_loaded = store is None
+        self._folder_index = None
+        self.store = store
         self.server = server
-        self.folder = None
         self.artist_ids = None
         self.song_ids = None
         self.album_ids = None
         self.last_update = None
+        self.server_modified = None
         self.prev_res = []
+        self.token_index = None
+        # The artists changed since the library was saved, by ID, with None for those removed. None
+        #  rather than a dictionary if the library has never been saved, so it has to be saved whole.
+        self.unsaved = None if store is None else {}
+        self.unsaved_folder = False
+        # The changed artists journaled by the store, in order, and the lookups they override
+        self._journal = []
+        self._overlay = None
+        if store is not None:
+            self.__dict__.update(store.load_meta())
+        # When the library was last saved whole, which the word index saved with it must match
+        self.saved_update = self.last_update
+        if store is not None:
+            journal = store.load_journal(server)
+            self.__dict__.update(journal['meta'])
+            self._journal = journal['artists']
+            if 'folder' in journal:
+                self.folder = journal['folder']
+                self.unsaved_folder = False
+
+    def __setstate__(self, state: dict) -> None:
+        # Libraries pickled by older versions keep the tree under the public names
+        if 'artists' in state:
+            state['_artists'] = state.pop('artists')
+        if 'folder' in state:
+            state['_folder'] = state.pop('folder')
+        state.setdefault('_folder_loaded', True)
+        state.setdefault('_folder_index', None)
+        state.setdefault('token_index', None)
+        state.setdefault('saved_update', None)
+        state.setdefault('unsaved', None)
+        state.setdefault('unsaved_folder', False)
+        state.setdefault('_journal', [])
+        state.setdefault('_overlay', None)
+        self.__dict__.update(state)
+
+    @property
+    def artists(self) -> List['pysonic.Artist']:
+        """All the artists in the library, read from the store on first use. """
+
+        if self._artists is None:
+            artists = self.store.load_artists(self.server)
+            positions = {}
+            for position, one_artist in enumerate(artists):
+                positions.setdefault(one_artist.data_dict['id'], position)
+            for artist_id, one_artist in self._journal:
+                if artist_id in positions:
+                    artists[positions[artist_id]] = one_artist
+                    if one_artist is None:
+                        del positions[artist_id]
+                elif one_artist is not None:
+                    positions[artist_id] = len(artists)
+                    artists.append(one_artist)
+            self._artists = [x for x in artists if x is not None]
+        return self._artists
+
+    @artists.setter
+    def artists(self, artists: List['pysonic.Artist']) -> None:
+        self._artists = artists
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the artists are in memory. """
+
+        return self._artists is not None
+
+    @property
+    def folder(self) -> Optional['pysonic.Folder']:
+        """The folder hierarchy, if it has been built. Read from the store
+        on first use. """
+
+        if not self._folder_loaded:
+            self._folder = self.store.load_folder(self.server)
+            self._folder_loaded = True
+        return self._folder
+
+    @folder.setter
+    def folder(self, folder: Optional['pysonic.Folder']) -> None:
+        self._folder = folder
+        self._folder_loaded = True
+        self._folder_index = None
+        self.unsaved_folder = True
+
+    @property
+    def folder_index(self) -> Optional['pysonic.folder.FolderIndex']:
+        """The flat index of the folder hierarchy, if it has been built.
+        Made again whenever the hierarchy is replaced. """
+
+        if self._folder_index is None and self.folder is not None:
+            self._folder_index = pysonic.folder.FolderIndex(self.folder)
+        return self._folder_index
+
+    @property
+    def folder_loaded(self) -> bool:
+        """Whether the folder hierarchy is in memory. """
+
+        return self._folder_loaded
 
     def update_server(self, server: Optional['pysonic.Server']) -> None:
         """Update the server this library is linked to. """
         self.server = server
-        for one_artist in self.artists:
+        # Anything still in the store is linked to the server when it is read
+        for one_artist in self._artists or []:
             one_artist.update_server(server)
-        # TODO: Update folders also.
+        if self._folder is not None:
+            self._folder.update_server(server)
 
     def add_artist(self, artist_id: str) -> bool:
         """Add an artist to the library. """
@@ -39,51 +177,369 @@ class Library(object):
         new_artist = pysonic.Artist(artist_id, server=self.server)
         if new_artist:
             self.artists.append(new_artist)
+            if self.artist_ids is not None:
+                self._index_artist(new_artist)
+            self._changed(new_artist)
             return True
         else:
             return False
 
     def update_ids(self) -> None:
-        """Calculate a list of all song, album, and artist ids. """
+        """Index all the songs, albums and artists by ID. Where an ID is
+        used more than once, the first in the library is kept. """
 
-        self.album_ids = [x.data_dict['id'] for x in self.albums]
-        self.artist_ids = [x.data_dict['id'] for x in self.artists]
-        self.song_ids = [x.data_dict['id'] for x in self.songs]
+        self.artist_ids, self.album_ids, self.song_ids = {}, {}, {}
+        for one_artist in self.artists:
+            self.artist_ids.setdefault(one_artist.data_dict['id'], one_artist)
+            for one_album in one_artist:
+                self.album_ids.setdefault(one_album.data_dict['id'], one_album)
+                for one_song in one_album:
+                    self.song_ids.setdefault(one_song.data_dict['id'], one_song)
+
+    def take_unsaved(self) -> Tuple[Optional[Dict[str, Optional['pysonic.Artist']]], bool]:
+        """Return the artists changed since the library was last saved and
+        whether the folder hierarchy changed, and start noting changes
+        afresh. Changes made while these are saved are then kept for the
+        next save. """
+
+        res = self.unsaved, self.unsaved_folder
+        self.unsaved = {}
+        self.unsaved_folder = False
+        return res
 
-    def update_library(self) -> int:
-        """Check for new albums and artists. Return number of changes"""
+    def restore_unsaved(self, artists: Optional[Dict[str, Optional['pysonic.Artist']]], folder: bool) -> None:
+        """Note again changes taken to be saved, as saving them failed. """
+
+        self.unsaved = None if artists is None else {**artists, **self.unsaved}
+        self.unsaved_folder = self.unsaved_folder or folder
+
+    def mark_saved(self, last_update: Optional[float]) -> None:
+        """Note that the library has just been saved whole, as it was at
+        last_update, so the store has no journal left to apply. """
+
+        self.saved_update = last_update
+        self._journal = []
+        self._overlay = None
+
+    def _changed(self, one_artist: 'pysonic.Artist', removed: bool = False) -> None:
+        """Note that an artist changed, so that it is saved. """
+
+        if self.unsaved is not None:
+            self.unsaved[one_artist.data_dict['id']] = None if removed else one_artist
+
+    def _journal_overlay(self) -> Dict[Tuple[str, str], object]:
+        """Return the songs, albums and artists of the journaled artists by
+        kind and ID, with None for those the journal removed, for lookups
+        while the artists aren't loaded. """
+
+        if self._overlay is None:
+            overlay = {}
+            for artist_id, one_artist in self._journal:
+                key = ('artists', artist_id)
+                old = overlay[key] if key in overlay else self.store.get_artist(artist_id, self.server)
+                overlay.update(((kind, x.data_dict['id']), None) for kind, x in _items(old))
+                overlay.update(((kind, x.data_dict['id']), x) for kind, x in _items(one_artist))
+                overlay[key] = one_artist
+            self._overlay = overlay
+        return self._overlay
+
+    def load_token_index(self,
+                         unsaved: Dict[str, Optional['pysonic.Artist']] = None) -> Optional[Dict[str, TokenIndex]]:
+        """Return the word indexes saved with the library, with the changes
+        journaled since and the unsaved changes applied, or None if there
+        are none. The unsaved changes are those noted on the library unless
+        given, as when they are being saved. """
+
+        indexes = self.server.load_token_index(self)
+        if indexes is not None:
+            self._replay_journal(indexes, (self.unsaved if unsaved is None else unsaved) or {})
+        return indexes
+
+    def _replay_journal(self, indexes: Dict[str, TokenIndex],
+                        unsaved: Dict[str, Optional['pysonic.Artist']] = None) -> None:
+        """Apply the changes journaled since the store was written, and then
+        any unsaved changed artists, to word indexes of the store. """
+
+        replayed = {}
+        for artist_id, one_artist in chain(self._journal, (unsaved or {}).items()):
+            old = replayed[artist_id] if artist_id in replayed else self.store.get_artist(artist_id, self.server)
+            for kind, item in _items(old):
+                indexes[kind].remove(item.data_dict)
+            for kind, item in _items(one_artist):
+                indexes[kind].add(item.data_dict)
+            replayed[artist_id] = one_artist
+
+    def get_token_index(self) -> Dict[str, TokenIndex]:
+        """Return the word indexes of the songs, albums and artists. They
+        are read from disk, or built and saved, on first use. A library
+        still in its store is indexed from the rows of the store, so that
+        searching it doesn't load it. """
+
+        if self.token_index is None:
+            self.token_index = self.load_token_index()
+            if self.token_index is None and not self.loaded:
+                # Saved as the index of the store, which the journal is applied over when it is read
+                self.token_index = index.build({x: self.store.records(x) for x in index.WEIGHTS})
+                self.server.save_token_index(self)
+                self._replay_journal(self.token_index)
+            elif self.token_index is None:
+                self.token_index = index.build({'songs': (x.data_dict for x in self.songs),
+                                                'albums': (x.data_dict for x in self.albums),
+                                                'artists': (x.data_dict for x in self.artists)})
+                self.server.save_token_index(self)
+        return self.token_index
+
+    def _fuzzy_search(self, kind: str, search: str, get_item: Callable) -> Tuple[list, List[float]]:
+        """Return the items of a kind most like the search, allowing for
+        typos, and how alike each one is from 0 to 1. """
+
+        matches = self.get_token_index()[kind].fuzzy_search(search)
+        return [get_item(x) for x, _ in matches], [x for _, x in matches]
+
+    # The following keep the ID and word indexes up to date as the library changes
+    def _index_artist(self, one_artist: 'pysonic.Artist') -> None:
+        self.artist_ids.setdefault(one_artist.data_dict['id'], one_artist)
+        if self.token_index is not None:
+            self.token_index['artists'].add(one_artist.data_dict)
+        for one_album in one_artist:
+            self._index_album(one_album)
+
+    def _index_album(self, one_album: 'pysonic.Album') -> None:
+        self.album_ids.setdefault(one_album.data_dict['id'], one_album)
+        if self.token_index is not None:
+            self.token_index['albums'].add(one_album.data_dict)
+        for one_song in one_album:
+            self.song_ids.setdefault(one_song.data_dict['id'], one_song)
+            if self.token_index is not None:
+                self.token_index['songs'].add(one_song.data_dict)
+
+    def _unindex_artist(self, one_artist: 'pysonic.Artist') -> None:
+        if self.artist_ids.get(one_artist.data_dict['id']) is one_artist:
+            del self.artist_ids[one_artist.data_dict['id']]
+            if self.token_index is not None:
+                self.token_index['artists'].remove(one_artist.data_dict)
+        for one_album in one_artist:
+            self._unindex_album(one_album)
+
+    def _unindex_album(self, one_album: 'pysonic.Album') -> None:
+        if self.album_ids.get(one_album.data_dict['id']) is one_album:
+            del self.album_ids[one_album.data_dict['id']]
+            if self.token_index is not None:
+                self.token_index['albums'].remove(one_album.data_dict)
+        for one_song in one_album:
+            if self.song_ids.get(one_song.data_dict['id']) is one_song:
+                del self.song_ids[one_song.data_dict['id']]
+                if self.token_index is not None:
+                    self.token_index['songs'].remove(one_song.data_dict)
+
+    def server_last_modified(self) -> Optional[int]:
+        """Return when the server says its library last changed, in
+        milliseconds since the epoch, or None if it won't say. """
+
+        since = getattr(self, 'server_modified', None)
+        if since is None and self.last_update is not None:
+            since = int(self.last_update * 1000)
+        # The server sends an empty index if nothing changed since then
+        extras = {'ifModifiedSince': since} if since is not None else {}
+        for indexes in self.server.sub_request(page="getIndexes", list_type='indexes', extras=extras,
+                                               incremental=True):
+            if 'lastModified' in indexes.attrib:
+                return int(indexes.attrib['lastModified'])
+        return None
 
+    def update_library(self, verbose: bool = True) -> int:
+        """Bring the library in line with the server, adding, updating and
+        removing artists, albums and songs in place. Print what changed
+        if verbose. Return number of changes"""
+
+        started = time.time()
+        known = getattr(self, 'server_modified', None)
+        last_modified = self.server_last_modified()
+        if last_modified is not None:
+            # Compare with our own clock only until the server has told us its time once
+            if last_modified == known or (known is None and self.last_update is not None and
+                                          last_modified <= self.last_update * 1000):
+                self.server_modified = last_modified
+                self.last_update = started
+                return 0
+
+        if self.artist_ids is None:
+            self.update_ids()
+        # Bring the saved word index along, so that it is updated rather than built again
+        if self.token_index is None:
+            self.token_index = self.load_token_index()
+        remote_artists = {x.attrib['id']: x.attrib for x in
+                          self.server.sub_request(page="getArtists", list_type='artist', incremental=True)}
+        remote_albums = {x['id']: x for x in
+                         self.fetch_pages("getAlbumList2", 'album', {'type': 'alphabeticalByName'}, 'size', 'offset',
+                                          expected=sum(int(x.get('albumCount', 0)) for x in remote_artists.values()))}
         updates = 0
+        changed_artists = []
+
+        # Removed artists and albums
+        for artist_id in self.artist_ids.keys() - remote_artists.keys():
+            removed = self.artist_ids[artist_id]
+            self.artists.remove(removed)
+            self._unindex_artist(removed)
+            self._changed(removed, removed=True)
+            updates += 1
+        for one_artist in self.artists:
+            removed = [x for x in one_artist.albums if x.data_dict['id'] not in remote_albums]
+            if removed:
+                updates += len(removed)
+                one_artist.albums = [x for x in one_artist.albums if x.data_dict['id'] in remote_albums]
+                for one_album in removed:
+                    self._unindex_album(one_album)
+                self._changed(one_artist)
+
+        # Albums moved to another artist leave the old one, and are added to the new one with the new albums
+        for one_artist in self.artists:
+            artist_id = one_artist.data_dict['id']
+            moved = [x for x in one_artist.albums
+                     if remote_albums[x.data_dict['id']].get('artistId', artist_id) != artist_id]
+            if moved:
+                one_artist.albums = [x for x in one_artist.albums if x not in moved]
+                for one_album in moved:
+                    self._unindex_album(one_album)
+                self._changed(one_artist)
+
+        # Renamed or otherwise changed artists
+        for one_artist in self.artists:
+            remote = remote_artists[one_artist.data_dict['id']]
+            if any(remote.get(x) != one_artist.data_dict.get(x) for x in ARTIST_CHANGE_FIELDS):
+                if self.token_index is not None:
+                    self.token_index['artists'].remove(one_artist.data_dict)
+                one_artist.data_dict = utils.compact({**one_artist.data_dict, **remote}, pysonic.artist.ARTIST_FIELDS,
+                                                     unique=('id',))
+                if self.token_index is not None:
+                    self.token_index['artists'].add(one_artist.data_dict)
+                self._changed(one_artist)
+                updates += 1
 
-        self.update_ids()
-        new_albums = self.server.sub_request(page="getAlbumList2",
-                                             list_type='album',
-                                             extras={'type': 'newest', 'size': 50})
-
-        for one_album in new_albums:
-            if one_album.attrib['artistId'] not in self.artist_ids:
-                if self.add_artist(one_album.attrib['artistId']):
-                    self.update_ids()
-            elif one_album.attrib['id'] not in self.album_ids:
-                artist = self.get_artist_by_id(one_album.attrib['artistId'])
-                artist.add_albums([one_album])
-                self.update_ids()
-                print(artist.recursive_str())
+        # Changed albums are fetched again, which picks up added, changed and removed songs
+        for one_artist in self.artists:
+            for position, one_album in enumerate(one_artist.albums):
+                remote = remote_albums[one_album.data_dict['id']]
+                if any(remote.get(x) != one_album.data_dict.get(x) for x in ALBUM_CHANGE_FIELDS):
+                    self._unindex_album(one_album)
+                    one_artist.albums[position] = pysonic.Album(remote, server=self.server)
+                    self._index_album(one_artist.albums[position])
+                    self._changed(one_artist)
+                    changed_artists.append(one_artist)
+                    updates += 1
+
+        # New albums go to their artist, new artists are fetched with all their albums
+        for album_id in remote_albums.keys() - self.album_ids.keys():
+            remote = remote_albums[album_id]
+            artist = self.artist_ids.get(remote.get('artistId'))
+            if artist is not None:
+                artist.albums.append(pysonic.Album(remote, server=self.server))
+                self._index_album(artist.albums[-1])
+                artist.sort_albums()
+                self._changed(artist)
+                changed_artists.append(artist)
+                updates += 1
+        for artist_id in remote_artists.keys() - self.artist_ids.keys():
+            if self.add_artist(artist_id):
+                changed_artists.append(self.artists[-1])
                 updates += 1
-        self.last_update = time.time()
 
-        # Clear the cached properties
-        self.__dict__.pop('songs', None)
-        self.__dict__.pop('albums', None)
+        # Artists without albums aren't kept, as in a fresh build
+        for one_artist in self.artists:
+            if not one_artist:
+                self._unindex_artist(one_artist)
+                self._changed(one_artist, removed=True)
+        self.artists = [x for x in self.artists if x]
+
+        if verbose:
+            for one_artist in dict.fromkeys(changed_artists):
+                print(one_artist.recursive_str())
+        self.last_update = started
+        self.server_modified = last_modified
         return updates
 
     def fill_artists(self) -> None:
         """Query the server for all the artists and albums. """
 
-        for one_artist in self.server.sub_request(page="getArtists", list_type='artist'):
-            self.add_artist(one_artist.attrib['id'])
+        # Anything that changes while the library builds is picked up by the next update
+        self.last_update = time.time()
+        artists = [x.attrib for x in self.server.sub_request(page="getArtists", list_type='artist',
+                                                              incremental=True)]
+        self.progress = BuildProgress(self.server, sum(int(x.get('albumCount', 0)) for x in artists))
+
+        try:
+            if self.server.build_strategy == "bulk":
+                self.fill_artists_bulk(artists)
+            elif self.server.workers > 1:
+                # Artists and albums get their own pools so that an artist waiting on its
+                #  albums can never starve the album fetches of workers
+                with ThreadPoolExecutor(max_workers=self.server.limiter.max_limit) as artist_pool, \
+                        ThreadPoolExecutor(max_workers=self.server.limiter.max_limit) as album_pool:
+                    new_artists = artist_pool.map(lambda x: pysonic.Artist(x['id'], server=self.server,
+                                                                           executor=album_pool), artists)
+                    self.artists.extend(x for x in new_artists if x)
+            else:
+                for one_artist in artists:
+                    self.add_artist(one_artist['id'])
+            self.progress.finish()
+        finally:
+            self.progress = None
         self.initialized = True
 
+    def fill_artists_bulk(self, artists: List[dict]) -> None:
+        """Build the same library as fill_artists, but enumerate the whole
+        catalogue with a few large paged requests rather than one request
+        per artist and album. """
+
+        albums = self.fetch_pages("getAlbumList2", 'album', {'type': 'alphabeticalByName'}, 'size', 'offset',
+                                  expected=sum(int(x.get('albumCount', 0)) for x in artists))
+        songs = self.fetch_pages("search3", 'song', {'query': '', 'artistCount': 0, 'albumCount': 0},
+                                 'songCount', 'songOffset',
+                                 expected=sum(int(x.get('songCount', 0)) for x in albums))
+
+        songs_by_album = defaultdict(list)
+        for one_song in songs:
+            songs_by_album[one_song.get('albumId')].append(one_song)
+        albums_by_artist = defaultdict(list)
+        for one_album in albums:
+            albums_by_artist[one_album.get('artistId')].append(one_album)
+
+        for one_artist in artists:
+            new_artist = pysonic.Artist(server=self.server, data_dict=one_artist)
+            for one_album in albums_by_artist[one_artist['id']]:
+                album_songs = songs_by_album.get(one_album['id'], [])
+                # Not every server will enumerate songs through search3, so fall back
+                #  to fetching any album that came back incomplete
+                if not album_songs or len(album_songs) < int(one_album.get('songCount', 0)):
+                    album_songs = None
+                new_artist.albums.append(pysonic.Album(one_album, server=self.server, songs=album_songs))
+            new_artist.sort_albums()
+            if new_artist:
+                self.artists.append(new_artist)
+
+    def fetch_pages(self, page: str, list_type: str, extras: dict, size_param: str, offset_param: str,
+                    expected: int = 0) -> List[dict]:
+        """Fetch every item from a paged endpoint and return their attribute
+        dictionaries. If the number of items to expect is known, the pages
+        up to that point are fetched in parallel. """
+
+        def fetch_page(offset: int) -> List[dict]:
+            return [x.attrib for x in self.server.sub_request(page=page, list_type=list_type,
+                                                               extras={**extras, size_param: BULK_PAGE_SIZE,
+                                                                       offset_param: offset},
+                                                               incremental=True)]
+
+        offsets = range(0, max(expected, 1), BULK_PAGE_SIZE)
+        with ThreadPoolExecutor(max_workers=self.server.limiter.max_limit) as page_pool:
+            pages = list(page_pool.map(fetch_page, offsets))
+
+        # Keep going in case the server has more than it claimed
+        offset = offsets[-1]
+        while len(pages[-1]) == BULK_PAGE_SIZE:
+            offset += BULK_PAGE_SIZE
+            pages.append(fetch_page(offset))
+        return [item for one_page in pages for item in one_page]
+
     def play_string(self, playable_list: 'pysonic.Playable' = None) -> (str, int):
         """Return the needed playlist data, and the number of items in the playlist. """
 
@@ -132,36 +588,29 @@ class Library(object):
         self.prev_res = similar
         pysonic.print_song_list(similar)
 
-    @cached_property
+    @property
     def songs(self) -> List['pysonic.Song']:
         """Return a list of all songs in the library. """
 
-        ret_songs = []
-        for one_artist in self:
-            for one_album in one_artist:
-                for one_song in one_album:
-                    ret_songs.append(one_song)
-        return ret_songs
+        if self.song_ids is None:
+            self.update_ids()
+        return list(self.song_ids.values())
 
-    @cached_property
+    @property
     def albums(self) -> List['pysonic.Album']:
         """Return a list of all albums in the library. """
 
-        ret_albums = []
-        for one_artist in self:
-            for one_album in one_artist:
-                ret_albums.append(one_album)
-        return ret_albums
+        if self.album_ids is None:
+            self.update_ids()
+        return list(self.album_ids.values())
 
     def get_scrobble_url(self, song_id: str) -> str:
         """ Returns the URL to fetch in order to scrobble a song. """
 
         server = self.server
-        server.generate_md5_password()
 
         # Add request specific parameters to our hash
-        params = server.default_params.copy()
-        params.update({'id': song_id})
+        params = {**server.default_params, **server.generate_md5_password(), 'id': song_id}
 
         # Encode our parameters and send the request
         params = urlencode(params)
@@ -171,51 +620,93 @@ class Library(object):
 
         return url
 
-    def get_song_by_id(self, song_id: str) -> Optional['pysonic.Song']:
-        """Fetch a song from the library based on its ID. """
-        for one_song in self.songs:
-            if one_song.data_dict['id'] == str(song_id):
-                self.prev_res = [one_song]
-                return one_song
-        self.prev_res = []
-        return None
+    def _stored(self, kind: str, item_id: str, lookup: Callable) -> Optional[object]:
+        """Look an item up in the store, unless the journal changed it. """
+
+        key = (kind, str(item_id))
+        overlay = self._journal_overlay()
+        if key in overlay:
+            return overlay[key]
+        return lookup(item_id, self.server)
+
+    def get_song_by_id(self, song_id: str, remember: bool = True) -> Optional['pysonic.Song']:
+        """Fetch a song from the library based on its ID. It becomes the
+        previous result unless remember is unset. """
+        if not self.loaded:
+            one_song = self._stored('songs', song_id, self.store.get_song)
+        else:
+            if self.song_ids is None:
+                self.update_ids()
+            one_song = self.song_ids.get(str(song_id))
+        if remember:
+            self.prev_res = [one_song] if one_song else []
+        return one_song
 
     def get_artist_by_id(self, artist_id: str) -> Optional['pysonic.Artist']:
         """Return an artist based on ID. """
 
-        for one_artist in self.artists:
-            if one_artist.data_dict['id'] == str(artist_id):
-                return one_artist
-        return None
+        if not self.loaded:
+            return self._stored('artists', artist_id, self.store.get_artist)
+        if self.artist_ids is None:
+            self.update_ids()
+        return self.artist_ids.get(str(artist_id))
 
     def get_album_by_id(self, album_id: str) -> Optional['pysonic.Album']:
         """Return an album based on ID. """
 
-        for one_album in self.albums:
-            if one_album.data_dict['id'] == str(album_id):
-                return one_album
-        return None
+        if not self.loaded:
+            return self._stored('albums', album_id, self.store.get_album)
+        if self.album_ids is None:
+            self.update_ids()
+        return self.album_ids.get(str(album_id))
+
+    def find(self, kind: str, search: str = None) -> Tuple[list, Optional[List[float]], bool]:
+        """Return the songs, albums or artists matching one or more IDs or
+        a query, best first, with their scores if they were ranked, and
+        whether the search was fuzzy. A query starting with ~ is fuzzy, as
+        is one whose words nothing has. A "quoted" query matches that text
+        anywhere in the name. Everything matches no query. """
+
+        get_item = {'songs': self.get_song_by_id, 'albums': self.get_album_by_id,
+                    'artists': self.get_artist_by_id}[kind]
+        if not search:
+            return getattr(self, kind), None, False
+
+        chunks = search.split(" ")
+        # They are searching by one or more ID
+        if all(x.isdigit() for x in chunks):
+            return [x for x in map(get_item, chunks) if x is not None], None, False
+        if search.startswith("~"):
+            return self._fuzzy_search(kind, search[1:], get_item) + (True,)
+        if len(search) > 1 and search.startswith('"') and search.endswith('"'):
+            return self._name_search(kind, search[1:-1]), None, False
+        if index.tokenise(search):
+            matches = self.get_token_index()[kind].search(search)
+            if matches:
+                return [get_item(x) for x, _ in matches], [x for _, x in matches], False
+            # Nothing has all the words, so show what comes closest in case of a typo
+            return self._fuzzy_search(kind, search, get_item) + (True,)
+        # Queries without any words, such as punctuation, match anywhere in the name
+        return self._name_search(kind, search), None, False
+
+    def _name_search(self, kind: str, search: str) -> list:
+        """Return the songs, albums or artists whose name contains the text,
+        ignoring case. A library still in its store is searched there, with
+        the journaled artists searched in place of their stored versions. """
+
+        if self.loaded:
+            return [x for x in getattr(self, kind) if search.lower() in x.data_dict[NAME_FIELDS[kind]].lower()]
+        overlay = self._journal_overlay()
+        res = [x for x in getattr(self.store, f"search_{kind}")(search, self.server)
+               if (kind, x.data_dict['id']) not in overlay]
+        res.extend(x for (item_kind, _), x in overlay.items() if item_kind == kind and x is not None and
+                   search.lower() in x.data_dict[NAME_FIELDS[kind]].lower())
+        return res
 
     def search_songs(self, search: str = None, store_only: bool = False) -> None:
         """Search through song names or ids for the query. """
 
-        if search:
-            res = []
-
-            chunks = search.split(" ")
-            # They are searching by one or more ID
-            if all(x.isdigit() for x in chunks):
-                for chunk in chunks:
-                    for one_song in self.songs:
-                        if one_song.data_dict['id'] == chunk:
-                            res.append(one_song)
-            else:
-                for one_song in self.songs:
-                    if search.lower() in one_song.data_dict['title'].lower():
-                        res.append(one_song)
-        else:
-            res = self.songs
-
+        res, scores, fuzzy = self.find('songs', search)
         self.prev_res = res
 
         if store_only:
@@ -228,7 +719,7 @@ class Library(object):
 
         # There is a query
         else:
-            pysonic.print_song_list(res)
+            pysonic.print_song_list(res, scores if fuzzy else None)
 
     def search_playlists(self, search: str = None) -> None:
         """Search through playlists. """
@@ -261,31 +752,17 @@ class Library(object):
     def search_albums(self, search: str = None) -> None:
         """Search through albums names or ids for the query. """
 
-        if search:
-            res = []
-
-            # See if they are adding multiple album by ID
-            chunks = search.split(" ")
-            if all(x.isdigit() for x in chunks):
-                for chunk in chunks:
-                    for one_album in self.albums:
-                        if one_album.data_dict['id'] == chunk:
-                            res.append(one_album)
-            else:
-                for one_album in self.albums:
-                    if search.lower() in one_album.data_dict['name'].lower():
-                        res.append(one_album)
-        else:
-            res = self.albums
-
+        res, scores, fuzzy = self.find('albums', search)
         self.prev_res = res
 
         # Print the results
         if len(res) == 0:
             print("No albums matched your query.")
             return
-        for one_album in res:
-            if search:
+        for position, one_album in enumerate(res):
+            if fuzzy:
+                print("%3d%% %s" % (round(scores[position] * 100), one_album.recursive_str(0)))
+            elif search:
                 print(one_album)
             else:
                 print(one_album.recursive_str(0))
@@ -293,33 +770,17 @@ class Library(object):
     def search_artists(self, search: str = None) -> None:
         """Search through artists names or ids for the query. """
 
-        if search:
-            res = []
-
-            chunks = search.split(" ")
-            # They are searching by one or more ID
-            if all(x.isdigit() for x in chunks):
-                for chunk in chunks:
-                    for one_artist in self.artists:
-                        if one_artist.data_dict['id'] == chunk:
-                            res.append(one_artist)
-
-            # They are searching by name
-            else:
-                for one_artist in self.artists:
-                    if search.lower() in one_artist.data_dict['name'].lower():
-                        res.append(one_artist)
-        else:
-            res = self.artists
-
+        res, scores, fuzzy = self.find('artists', search)
         self.prev_res = res
 
         # Print the results
         if len(res) == 0:
             print("No artists matched your query.")
             return
-        for one_artist in res:
-            if search:
+        for position, one_artist in enumerate(res):
+            if fuzzy:
+                print("%3d%% %s" % (round(scores[position] * 100), one_artist.recursive_str(0)))
+            elif search:
                 print(one_artist.recursive_str(1))
             else:
                 print(one_artist.recursive_str(0))
@@ -327,35 +788,43 @@ class Library(object):
     def search_folders(self, search: str = None) -> None:
         """ Search through the folders for the query or id. """
 
-        if not hasattr(self, 'folder') or self.folder is None:
+        if self.folder is None:
             print("Building folder...")
-            self.folder = pysonic.Folder(server=self.server)
-            # Pickle the new library
+            self.folder = pysonic.folder.FolderCrawl(self.server, library=self).run()
+            # Save the new library
             self.server.pickle()
 
-        res = []
-        if search:
-
-            for one_folder in self.folder.get_subfolders:
-                if search.isdigit():
-                    if one_folder.data_dict['id'] == search:
-                        res.append(one_folder)
-                else:
-                    title = one_folder.data_dict.get('title', '?').lower()
-                    if title == "?":
-                        title = one_folder.data_dict.get('name', '?').lower()
-                    if search.lower() in title:
-                        res.append(one_folder)
-        else:
-            res = self.folder.children
-
-        self.prev_res = res
-
-        for one_folder in res:
-            if search:
-                print(one_folder.recursive_str(1))
-            else:
+        if not search:
+            self.prev_res = self.folder.children
+            for one_folder in self.prev_res:
                 print(one_folder.recursive_str(0))
+            return
+
+        folder_index = self.folder_index
+        if search.isdigit():
+            found = folder_index.find(search)
+            positions = [] if found is None else [found]
+        else:
+            positions = folder_index.search(search)
+        self.prev_res = [folder_index.folders[x] for x in positions]
+
+        for position in positions:
+            # Show where the folder is, and how many songs are in it and under it
+            path = " / ".join(pysonic.folder.folder_name(x) for x in folder_index.path(position))
+            print("%s (%d songs)" % (path, folder_index.song_counts[position]))
+            print(folder_index.folders[position].recursive_str(1))
+
+    def refresh_folder(self, verbose: bool = True) -> Optional[Tuple[int, int]]:
+        """Fetch the directories whose timestamps changed on the server
+        into the folder hierarchy, keeping the rest as they are. Return how
+        many directories were skipped and how many were fetched again, or
+        None if the hierarchy hasn't been built. """
+
+        if self.folder is None:
+            return None
+        crawl = pysonic.folder.FolderCrawl(self.server, previous=self.folder, library=self)
+        self.folder = crawl.run(verbose)
+        return crawl.skipped, crawl.refetched
 
     def get_special_albums(self, album_type: str = 'newest', number: int = 10) -> None:
         """Returns either new or random albums. """
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict
+
+from pysonic.dataclasses import LimitAdjustment
+
+# A response this many times slower than the running average means the server is struggling...
+LATENCY_FACTOR = 3
+# ...unless it is still faster than this many seconds anyway
+MIN_SLOW_LATENCY = 0.5
+# Weight of the newest sample in the running average latency
+LATENCY_SMOOTHING = 0.1
+
+
+class AdaptiveLimiter(object):
+    """Limits how many requests may be in flight to one server, adapting
+    the limit to how the server copes (AIMD). The limit starts at
+    start_limit. Every quick, successful response raises it by 1/limit,
+    so it grows by about one per round of requests, up to max_limit if
+    that is above start_limit; otherwise it never grows past the start. A
+    failure (5xx, timeout, dropped connection) or a response much slower
+    than the running average latency of its endpoint halves it, at most
+    once per average latency so that one bad burst only counts once.
+    Optionally also caps the number of requests sent per second. Every
+    change to the limit is kept in history. """
+
+    def __init__(self, start_limit: int, max_limit: int = 0, max_rps: float = 0, history_size: int = 200):
+        start_limit = max(1, start_limit)
+        self.max_limit = max(start_limit, max_limit)
+        self.limit = float(start_limit)
+        self.max_rps = max_rps
+        self.in_flight = 0
+        # Endpoints answer at very different speeds, so each has its own running average
+        self.average_latency: Dict[str, float] = {}
+        self.history: Deque[LimitAdjustment] = deque(maxlen=history_size)
+        self._last_decrease = 0
+        self._next_send = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Block until another request may be sent. """
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+            # Space requests out evenly if there is a rate cap
+            delay = 0
+            if self.max_rps:
+                now = time.monotonic()
+                send_at = max(now, self._next_send)
+                self._next_send = send_at + 1 / self.max_rps
+                delay = send_at - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self, latency: float, failed: bool = False, endpoint: str = "") -> None:
+        """Record how a request to an endpoint went and let the next one
+        through. """
+
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            average = self.average_latency.get(endpoint)
+            slow = average is not None and latency > MIN_SLOW_LATENCY and latency > LATENCY_FACTOR * average
+            if failed or slow:
+                if now - self._last_decrease > (average or 0):
+                    self._last_decrease = now
+                    self._adjust(max(1.0, self.limit / 2), "failure" if failed else f"slow response ({latency:.2f}s)")
+            else:
+                self._adjust(min(float(self.max_limit), self.limit + 1 / self.limit), "success")
+
+            # Slow responses count too, so that the average follows an endpoint that has become slower for good
+            if not failed:
+                average = latency if average is None else average
+                self.average_latency[endpoint] = average + LATENCY_SMOOTHING * (latency - average)
+            self._condition.notify_all()
+
+    def _adjust(self, new_limit: float, reason: str) -> None:
+        """Change the limit, recording the change if the number of allowed
+        requests actually changed. Must hold the lock. """
+
+        if int(new_limit) != int(self.limit):
+            self.history.append(LimitAdjustment(time.time(), int(self.limit), int(new_limit), reason))
+        self.limit = new_limit
+
+    def __repr__(self) -> str:
+        return f"AdaptiveLimiter(limit={int(self.limit)}, max_limit={self.max_limit}, max_rps={self.max_rps})"
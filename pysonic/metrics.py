@@ -0,0 +1,182 @@
+import bisect
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+import pysonic
+import pysonic.utils as utils
+
+# Several libraries may build at once, and they all share the terminal
+_output_lock = threading.Lock()
+_last_drawn = None
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+class EndpointStats(object):
+    """Counters and a latency histogram for one endpoint of one server. """
+
+    __slots__ = ('count', 'failures', 'retries', 'bytes', 'latency', 'parse_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency = 0.0
+        self.parse_time = 0.0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    def percentile(self, fraction: float) -> float:
+        """Estimate a latency percentile as the upper bound of the bucket
+        it falls into. """
+
+        wanted = fraction * sum(self.histogram)
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return bound
+        return 0.0
+
+
+class Metrics(object):
+    """Request statistics for one server, kept per endpoint. Safe to
+    update from several threads. """
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, page: str, latency: float = 0.0, size: int = 0, parse_time: float = 0.0,
+               retries: int = 0, failed: bool = False) -> None:
+        """Record one request to an endpoint. """
+
+        with self._lock:
+            stats = self.endpoints.get(page)
+            if stats is None:
+                stats = self.endpoints[page] = EndpointStats()
+            stats.count += 1
+            stats.failures += failed
+            stats.retries += retries
+            stats.bytes += size
+            stats.latency += latency
+            stats.parse_time += parse_time
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    @property
+    def requests(self) -> int:
+        """How many requests were made in total. """
+
+        with self._lock:
+            return sum(x.count for x in self.endpoints.values())
+
+    @property
+    def bytes(self) -> int:
+        """How many bytes were received in total. """
+
+        with self._lock:
+            return sum(x.bytes for x in self.endpoints.values())
+
+    @property
+    def latency(self) -> Optional[float]:
+        """The mean latency of pings in seconds, as they measure the round
+        trip without any transfer time, or of all requests if there have
+        been no pings. None if there have been no requests. """
+
+        with self._lock:
+            measured = [x for x in self.endpoints.values() if x.latency]
+            pings = [x for x in measured if x is self.endpoints.get('ping')]
+            measured = pings or measured
+            count = sum(x.count for x in measured)
+            return sum(x.latency for x in measured) / count if count else None
+
+    def __str__(self) -> str:
+        header = "%-18s %7s %5s %5s %9s %8s %7s %7s %8s" % ("Endpoint", "Count", "Fail", "Retry", "KB",
+                                                             "Avg ms", "p50 ms", "p95 ms", "Parse ms")
+        lines = [header, "-" * len(header)]
+        with self._lock:
+            for page in sorted(self.endpoints):
+                stats = self.endpoints[page]
+                lines.append("%-18s %7d %5d %5d %9.1f %8.1f %7s %7s %8.1f" % (
+                    page[:18], stats.count, stats.failures, stats.retries, stats.bytes / 1024,
+                    1000 * stats.latency / stats.count, _format_bound(stats.percentile(.5)),
+                    _format_bound(stats.percentile(.95)), 1000 * stats.parse_time / stats.count))
+        return "\n".join(lines)
+
+
+def _format_bound(bound: float) -> str:
+    """Format a histogram bucket bound in milliseconds. """
+
+    if bound == float('inf'):
+        return ">10000"
+    return "%d" % (bound * 1000)
+
+
+class BuildProgress(object):
+    """Keeps a single status line up to date while a library builds,
+    showing the albums (or other units) built so far, the request and
+    transfer rates, and an estimate of the time remaining. """
+
+    def __init__(self, server: 'pysonic.Server', total: int, unit: str = "albums"):
+        self.server = server
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started = time.monotonic()
+        self.requests = server.metrics.requests
+        self.bytes = server.metrics.bytes
+        self._last_print = 0
+        self._last_length = 0
+        self._lock = threading.Lock()
+
+    def advance(self, count: int = 1) -> None:
+        """Note that more units were built. Redraws at most five times a
+        second. """
+
+        with self._lock:
+            self.done += count
+            now = time.monotonic()
+            if now - self._last_print >= .2 or self.done >= self.total:
+                self._last_print = now
+                self._print(now)
+
+    def _print(self, now: float) -> None:
+        global _last_drawn
+
+        elapsed = max(now - self.started, 1e-6)
+        requests = (self.server.metrics.requests - self.requests) / elapsed
+        kilobytes = (self.server.metrics.bytes - self.bytes) / 1024 / elapsed
+        if 0 < self.done < self.total:
+            eta = "%ds" % (elapsed / self.done * (self.total - self.done))
+        else:
+            eta = "?" if self.done < self.total else "0s"
+        line = "%s: %d/%d %s, %.1f requests/s, %.1f KB/s, ETA %s" % (
+            self.server.server_name, min(self.done, self.total), self.total, self.unit, requests, kilobytes, eta)
+        line = line[:utils.get_width(1)]
+
+        with _output_lock:
+            # Redraw our own line in place, but don't overwrite another build's line
+            if _last_drawn is self:
+                sys.stdout.write("\r" + line + " " * (self._last_length - len(line)))
+            else:
+                sys.stdout.write(("\n" if _last_drawn is not None else "") + line)
+            sys.stdout.flush()
+            _last_drawn = self
+        self._last_length = len(line)
+
+    def finish(self) -> None:
+        """Draw the final state of the status line and end it. """
+
+        global _last_drawn
+
+        with self._lock:
+            self._print(time.monotonic())
+            with _output_lock:
+                if _last_drawn is self:
+                    sys.stdout.write("\n")
+                    sys.stdout.flush()
+                    _last_drawn = None
@@ -0,0 +1,124 @@
+import json
+from typing import BinaryIO, Iterator, List, Union
+from xml.etree import ElementTree as ETree
+from xml.etree.ElementTree import Element
+
+SUBSONIC_NS = '{http://subsonic.org/restapi}'
+
+
+class JSONElement(object):
+    """A minimal stand-in for an ElementTree Element built from a JSON
+    subsonic response. It offers the parts of the Element interface that
+    the rest of pysonic uses (tag, attrib, iteration over children, len(),
+    indexing and iter()), so callers can't tell which format the server
+    responded in. """
+
+    __slots__ = ('tag', 'attrib', 'children')
+
+    def __init__(self, tag: str, attrib: dict = None, children: List['JSONElement'] = None):
+        self.tag = tag
+        self.attrib = attrib if attrib is not None else {}
+        self.children = children if children is not None else []
+
+    def iter(self, tag: str = None) -> Iterator['JSONElement']:
+        """Yield this element and all of its descendants, in document
+        order, optionally only those with the given tag. """
+
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self.children:
+            yield from child.iter(tag)
+
+    # Implement expected methods
+    def __iter__(self) -> Iterator['JSONElement']:
+        return iter(self.children)
+
+    def __len__(self) -> int:
+        return len(self.children)
+
+    def __getitem__(self, item: Union[int, slice]) -> Union['JSONElement', List['JSONElement']]:
+        return self.children[item]
+
+    def __repr__(self) -> str:
+        return f"<JSONElement {self.tag!r} at {id(self):#x}>"
+
+
+def _attribute_value(value) -> str:
+    """Turn a JSON scalar into the string the XML API would have sent. """
+
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _build_element(tag: str, data: dict) -> JSONElement:
+    """Recursively convert one JSON object into a JSONElement. Scalars
+    become attributes, objects and lists of objects become children. """
+
+    element = JSONElement(SUBSONIC_NS + tag)
+    for key, value in data.items():
+        if isinstance(value, dict):
+            element.children.append(_build_element(key, value))
+        elif isinstance(value, list):
+            for item in value:
+                # Lists of plain values (e.g. OpenSubsonic 'moods') are element text in XML
+                if isinstance(item, dict):
+                    element.children.append(_build_element(key, item))
+        elif isinstance(value, str):
+            element.attrib[key] = value
+        else:
+            element.attrib[key] = _attribute_value(value)
+    return element
+
+
+def from_json(content: Union[str, bytes]) -> JSONElement:
+    """Parse a JSON subsonic response into a tree of JSONElements rooted
+    at the subsonic-response element. """
+
+    return _build_element('subsonic-response', json.loads(content)['subsonic-response'])
+
+
+class CountingReader(object):
+    """Wraps a binary file-like object and counts the bytes read from it. """
+
+    def __init__(self, source: BinaryIO):
+        self.source = source
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def iterparse(source: BinaryIO, tag: str) -> Iterator[Element]:
+    """Incrementally parse an XML subsonic response from a binary file-like
+    object and yield every element with the given tag as soon as it has
+    been read. Each element is cleared and dropped from the tree once the
+    caller moves on to the next one, so memory use doesn't depend on the
+    size of the response. Only the element's attrib dict (which survives
+    the clearing) should be held on to. Raises ValueError when the server
+    reports an error. """
+
+    parents = []
+    failed = False
+    for event, element in ETree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            # The status is an attribute of the root element
+            if not parents and element.attrib.get('status') != 'ok':
+                failed = True
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if failed and element.tag == SUBSONIC_NS + 'error':
+            raise ValueError(f"Server responded with error: {element.attrib.get('message', '?')}")
+        if element.tag == tag:
+            yield element
+
+        # Nothing that has been fully read needs to stay in memory. The attributes are replaced rather than
+        #  cleared, as the caller may still hold them, and clear() empties them in place in pure Python
+        element.attrib = {}
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
@@ -1,11 +1,16 @@
+import asyncio
+import functools
 import getpass
 import hashlib
 import logging
 import os
 import pickle
-import sys
+import threading
+import time
 from binascii import hexlify
-from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Union
+from urllib.parse import urlencode
 from xml.etree import ElementTree as ETree
 from xml.etree.ElementTree import Element
 
@@ -15,7 +20,13 @@ from requests.adapters import HTTPAdapter, Retry
 
 import pysonic
 import pysonic.utils as utils
+from pysonic import index, response
+from pysonic.cache import READ_ONLY_PREFIXES, ResponseCache, SingleFlight
 from pysonic.exceptions import PysonicException
+from pysonic.limiter import AdaptiveLimiter
+from pysonic.metrics import Metrics
+from pysonic.snapshot import Snapshot
+from pysonic.store import SQLiteStore
 
 
 class Server(object):
@@ -23,6 +34,7 @@ class Server(object):
     queries. """
 
     session: requests.Session = None
+    async_executor: ThreadPoolExecutor = None
 
     def __init__(self, server_id,
                  server_name: str,
@@ -31,15 +43,33 @@ class Server(object):
                  server_url: str,
                  enabled: bool = True,
                  bitrate: str = None,
-                 scrobble: bool = False):
+                 scrobble: bool = False,
+                 workers: int = 1,
+                 response_format: str = "xml",
+                 token_reuse: int = 0,
+                 build_strategy: str = "artist",
+                 max_rps: float = 0,
+                 max_workers: int = 0,
+                 storage: str = "snapshot",
+                 compress: bool = False):
         """A server object. """
 
+        if response_format not in ("xml", "json"):
+            raise ValueError(f"Unsupported response format '{response_format}', choose 'xml' or 'json'.")
+        if build_strategy not in ("artist", "bulk"):
+            raise ValueError(f"Unsupported build strategy '{build_strategy}', choose 'artist' or 'bulk'.")
+        # Libraries used to be pickled, and the snapshot has taken the pickle's place
+        if storage == "pickle":
+            storage = "snapshot"
+        if storage not in ("snapshot", "sqlite"):
+            raise ValueError(f"Unsupported storage '{storage}', choose 'snapshot' or 'sqlite'.")
+
         # Build the default parameters into a reusable hash
         self.default_params = {
             'u': user_name,
             'v': "1.13.0",
             'c': "subsonic-cli",
-            'f': "xml",
+            'f': response_format,
             'sid': server_id
         }
         # The 'sid' is not actually used by the server. We put it there
@@ -71,6 +101,24 @@ class Server(object):
         self.scrobble = scrobble
         self.server_name = server_name
         self.enabled = enabled
+        self.workers = max(1, int(workers))
+        self.response_format = response_format
+        self.build_strategy = build_strategy
+        self.max_rps = max(0.0, float(max_rps))
+        self.storage = storage
+        self.compress = compress
+
+        # A salt/token pair may be reused for this many seconds, which makes
+        #  signing thousands of stream URLs at once much cheaper
+        self.token_reuse = max(0, int(token_reuse))
+        self._token_lock = threading.Lock()
+        self._token = None
+        self._token_time = 0
+        self._decoded_password = (None, None)
+        self._save_lock = threading.Lock()
+        self._store_lock = threading.Lock()
+        # Only one folder crawl at a time, as they share the checkpoint
+        self.crawl_lock = threading.Lock()
 
         if bitrate == "":
             self.bitrate = None
@@ -78,41 +126,166 @@ class Server(object):
             self.bitrate = int(bitrate)
 
         self.online = False
+        self.cache = ResponseCache()
+        self.in_flight = SingleFlight()
+        # How far the limiter may raise the number of parallel requests above workers, 0 to keep it at workers
+        self.max_workers = max(0, int(max_workers))
+        # Thread pools are sized for the most requests the limiter may ever allow, and it decides how many go out
+        self.limiter = AdaptiveLimiter(self.workers, max_limit=self.max_workers, max_rps=self.max_rps)
+        self.metrics = Metrics()
         self.pickle_file = utils.get_home(self.server_name + ".pickle")
+        self.store_file = utils.get_home(self.server_name + (".sqlite" if storage == "sqlite" else ".snapshot"))
+        self.index_file = utils.get_home(self.server_name + ".index")
+        self.crawl_file = utils.get_home(self.server_name + ".crawl")
+        self.store = None
         self.library = pysonic.Library(server=self)
 
+        # The library build keeps up to two pools of workers busy, so make sure
+        #  there is a pooled connection for each of them
         self.session = requests.Session()
         retries = Retry(total=3, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504])
-        self.session.mount('http://', HTTPAdapter(max_retries=retries))
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
-
-    def generate_md5_password(self) -> None:
-        """Creates a random salt and sets the md5(password+salt) and
-        salt in the default args."""
+        pool_size = max(10, 2 * self.limiter.max_limit)
+        self.session.mount('http://', HTTPAdapter(max_retries=retries, pool_maxsize=pool_size))
+        self.session.mount('https://', HTTPAdapter(max_retries=retries, pool_maxsize=pool_size))
+
+    def generate_md5_password(self) -> dict:
+        """Creates a random salt and returns the md5(password+salt) and
+        salt as request parameters. Nothing shared is modified, so this
+        is safe to call from several threads at once. If token reuse is
+        configured, the same pair is handed out until it expires."""
+
+        if self.token_reuse:
+            with self._token_lock:
+                if self._token is None or time.monotonic() - self._token_time > self.token_reuse:
+                    self._token = self._new_token()
+                    self._token_time = time.monotonic()
+                return self._token
+        return self._new_token()
+
+    def _new_token(self) -> dict:
+        """Returns a fresh salt and md5(password+salt). """
+
+        # Decoding the stored password is only needed when it changes
+        encoded, pwd = self._decoded_password
+        if encoded != self.password:
+            pwd = bytes.fromhex(self.password[4:]).decode('utf-8')
+            self._decoded_password = (self.password, pwd)
 
         salt = utils.salt_generator()
-        self.default_params['s'] = salt
-
-        pwd = bytes.fromhex(self.password[4:]).decode('utf-8')
         to_hash = f"{pwd}{salt}".encode("ascii")
-        self.default_params['t'] = hashlib.md5(to_hash).hexdigest()
-
-    def pickle(self) -> None:
-        """ Pickles the song library and writes it to disk. """
+        return {'s': salt, 't': hashlib.md5(to_hash).hexdigest()}
+
+    def pickle(self, library: 'pysonic.Library' = None, whole: bool = False) -> None:
+        """ Saves the song library (or the given library) to disk, as a
+        snapshot or in the SQLite store depending on the configured
+        storage. A library that has been saved before only has its
+        changes saved, unless whole is set. Once the journal of changes
+        of a snapshot grows too large, a new snapshot is written in the
+        background. """
+
+        if library is None:
+            library = self.library
+
+        with self._save_lock:
+            store = self.open_store()
+            # Changes made while these are written, say by a folder refresh, are noted afresh for the next save
+            artists, folder = library.take_unsaved()
+            last_update = library.last_update
+            try:
+                if artists is not None and library.store is store and not whole and not store.is_empty():
+                    if not store.journaled and library.token_index is None:
+                        # Bring the saved word index along, as it won't match the store once changed in place
+                        library.token_index = library.load_token_index(artists)
+                    store.save_changes(library, artists, folder)
+                    if not store.journaled:
+                        # Nothing is left to apply over the store, just as if it had been saved whole
+                        library.mark_saved(last_update)
+                        if library.token_index is not None:
+                            self.save_token_index(library)
+                else:
+                    if library.token_index is None and library.store is store:
+                        # Bring the saved word index along, as it won't match the new snapshot otherwise
+                        library.token_index = library.load_token_index(artists)
+                    library.store = store
+                    store.save(library)
+                    library.mark_saved(last_update)
+                    if library.token_index is not None:
+                        self.save_token_index(library)
+            except Exception:
+                library.restore_unsaved(artists, folder)
+                raise
+            compact = store.needs_compaction()
+
+        if compact:
+            threading.Thread(target=self.pickle, args=(library, True), name=f"pysonic-compact-{self.server_name}",
+                             daemon=True).start()
+
+    def load_token_index(self, library: 'pysonic.Library') -> Optional[Dict[str, index.TokenIndex]]:
+        """ Load the word index saved with the library, returning None if
+        there is none for the library as it was last saved. """
+
+        return index.load(self.index_file, library.saved_update)
+
+    def save_token_index(self, library: 'pysonic.Library') -> None:
+        """ Save the word index of the library next to the library. """
+
+        index.save(self.index_file, library.token_index, library.saved_update)
+
+    def open_store(self) -> Union[Snapshot, SQLiteStore]:
+        """Open the store for this server's library, if it isn't open
+        yet. """
+
+        with self._store_lock:
+            if self.store is None:
+                if self.storage == "sqlite":
+                    self.store = SQLiteStore(self.store_file)
+                else:
+                    self.store = Snapshot(self.store_file, compress=self.compress)
+            return self.store
+
+    def load_library(self) -> Optional['pysonic.Library']:
+        """ Load the library saved on disk, returning None if there is no
+        usable one. A library pickled by an older version is moved into
+        the store the first time the store is used. """
+
+        store = self.open_store()
+        try:
+            if not store.is_empty():
+                return pysonic.Library(self, store=store)
+        except ValueError as err:
+            print(f"Library archive for {self.server_name} unusable ({err}). Rebuilding library.")
+            store.clear()
+            return None
+
+        library = self.load_pickle()
+        if library is not None:
+            print(f"Moving the library for {self.server_name} into {self.store_file}.")
+            self.pickle(library)
+            os.unlink(self.pickle_file)
+        return library
+
+    def load_pickle(self) -> Optional['pysonic.Library']:
+        """ Load a library pickled by an older version, returning None if
+        there is no usable one. """
 
-        # Don't save useless information in the pickle
-        self.library.update_server(None)
-        self.library.album_ids = None
-        self.library.artist_ids = None
-        self.library.song_ids = None
-        self.library.prev_res = None
+        try:
+            library = pickle.load(open(self.pickle_file, "rb"))
+        except IOError:
+            return None
+        except (EOFError, TypeError, AttributeError, pickle.UnpicklingError):
+            print(f"Library archive for {self.server_name} corrupt or generated by old version of pysonic. "
+                  "Rebuilding library.")
+            return None
+        library.update_server(self)
+        return library
 
-        # Dump the pickle
-        pickle.dump(self.library, open(utils.get_home(".tmp.pickle"), "wb"), 2)
-        os.rename(utils.get_home(".tmp.pickle"), self.pickle_file)
+    def delete_library(self) -> None:
+        """ Remove the library saved on disk, so that it is built again. """
 
-        # Re-set the server
-        self.library.update_server(self)
+        for one_file in (self.pickle_file, self.index_file, self.crawl_file):
+            if os.path.exists(one_file):
+                os.unlink(one_file)
+        self.open_store().clear()
 
     def print_config(self) -> str:
         """Return a string corresponding to the config file format
@@ -131,6 +304,14 @@ Password: {password}
 Bitrate: {print_bitrate}
 Enabled: {str(self.enabled)}
 Scrobble: {str(self.scrobble)}
+Workers: {str(self.workers)}
+Format: {self.response_format}
+TokenReuse: {str(self.token_reuse)}
+BuildStrategy: {self.build_strategy}
+MaxRPS: {self.max_rps:g}
+MaxWorkers: {str(self.max_workers)}
+Storage: {self.storage}
+Compress: {str(self.compress)}
 
 """
         return conf
@@ -143,42 +324,122 @@ Scrobble: {str(self.scrobble)}
                     list_type: str = 'subsonic-response',
                     extras: dict = None,
                     timeout: int = 10,
-                    return_root: bool = False) -> Union[List[Element], Element, str]:
-        """Query subsonic, parse resulting xml and return either
+                    return_root: bool = False,
+                    incremental: bool = False) -> Union[List[Element], Iterator[Element], Element, str]:
+        """Query subsonic, parse resulting xml (or json) and return either
          a list of Element objects, a stream URL if in stream mode,
-         or the root element if return_root is True."""
+         or the root element if return_root is True.
 
-        # Generate a unique salt for this request
-        self.generate_md5_password()
+         If incremental is True, the response is parsed as it is read and
+         a generator of the matching elements is returned instead of a list.
+         Each element is cleared as soon as the next one is requested, so
+         only keep hold of its attrib dict."""
 
         # Add request specific parameters to our hash
         if extras is None:
             extras = {}
 
-        # Prepare the requests
-        request = Request('GET', self.server_url.rstrip() + page.rstrip(), params={**self.default_params, **extras})
-        prepped = self.session.prepare_request(request)
-
-        # To stream we only want the URL returned, not the data
+        # To stream we only want the URL returned, not the data. Build it
+        #  directly, as preparing a full request costs far more than signing it
         if page == "stream":
-            return prepped.url
+            params = {**self.default_params, **self.generate_md5_password(), **extras}
+            self.metrics.record(page)
+            return self.server_url.rstrip() + page.rstrip() + "?" + urlencode(params)
+
+        # Serve read-only endpoints from the cache while the response is fresh
+        key = self.cache.make_key(page, list_type, extras, return_root)
+        cacheable = not incremental and self.cache.cacheable(page)
+        if cacheable:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return list(cached) if isinstance(cached, list) else cached
+
+        def fetch():
+            fetched = self._fetch(page, list_type, extras, timeout, return_root, incremental)
+            # A successful write may have made some cached responses stale
+            self.cache.invalidate_after(page)
+            if cacheable:
+                self.cache.put(key, fetched)
+            return fetched
+
+        # Identical reads that are already in flight share one request
+        if not incremental and page.strip().startswith(READ_ONLY_PREFIXES):
+            result = self.in_flight.do(key, fetch)
+        else:
+            result = fetch()
+        return list(result) if isinstance(result, list) else result
+
+    @property
+    def coalesced_requests(self) -> int:
+        """How many requests were answered by sharing the response of an
+        identical request that was already in flight. """
+
+        return self.in_flight.coalesced
+
+    def _fetch(self,
+               page: str,
+               list_type: str,
+               extras: dict,
+               timeout: int,
+               return_root: bool,
+               incremental: bool) -> Union[List[Element], Iterator[Element], Element]:
+        """Send a request to the server and parse the response, as
+        described in sub_request. """
+
+        # Prepare the requests, with a unique salt for this request
+        params = {**self.default_params, **self.generate_md5_password(), **extras}
+        request = Request('GET', self.server_url.rstrip() + page.rstrip(), params=params)
+        prepped = self.session.prepare_request(request)
 
         logging.debug(f'Request URL calculated as: {prepped.url}')
 
-        # Get the server response
+        # JSON can't be parsed incrementally, so only stream the body for XML
+        stream_body = incremental and not return_root and self.response_format == "xml"
+
+        # Get the server response, once the limiter allows another request
+        endpoint = page.strip()
+        self.limiter.acquire()
+        started = time.monotonic()
         try:
-            r = self.session.send(prepped, timeout=timeout)
+            r = self.session.send(prepped, timeout=timeout, stream=stream_body)
             r.raise_for_status()
-        except requests.HTTPError:
-            raise PysonicException("Request to subsonic server timed or failed three times in a row.")
-
-        # Parse the XML
-        root = ETree.fromstring(r.text)
+        except requests.RequestException as err:
+            latency = time.monotonic() - started
+            # Only the server struggling should slow us down, not a request it rightly refused
+            overloaded = (isinstance(err, (requests.Timeout, requests.ConnectionError, requests.exceptions.RetryError))
+                          or (err.response is not None and err.response.status_code >= 500))
+            self.limiter.release(latency, failed=overloaded, endpoint=endpoint)
+            self.metrics.record(endpoint, latency, failed=True)
+            if isinstance(err, requests.HTTPError):
+                raise PysonicException("Request to subsonic server timed or failed three times in a row.")
+            raise
+        latency = time.monotonic() - started
+        self.limiter.release(latency, endpoint=endpoint)
+        retry_state = getattr(r.raw, 'retries', None)
+        retries = len(retry_state.history) if retry_state else 0
+
+        if stream_body:
+            return self._iter_response(r, endpoint, list_type, latency, retries)
+
+        # Parse the response
+        parse_started = time.monotonic()
+        try:
+            if self.response_format == "json":
+                root = response.from_json(r.content)
+            else:
+                root = ETree.fromstring(r.content)
+        except Exception:
+            self.metrics.record(endpoint, latency, len(r.content), time.monotonic() - parse_started, retries,
+                                failed=True)
+            raise
+        failed = root.attrib['status'] != 'ok'
+        self.metrics.record(endpoint, latency, len(r.content), time.monotonic() - parse_started, retries,
+                            failed=failed)
 
-        logging.debug(f'Got response from server. As text:\n{r.text}\n\nAs parsed XML:\n{root}')
+        logging.debug(f'Got {len(r.content)} bytes from server in {latency:.3f}s.')
 
         # Make sure the result is valid
-        if root.attrib['status'] != 'ok':
+        if failed:
             raise ValueError(f"Server responded with error: {root[0].attrib['message']}")
 
         # Short circuit return the whole tree if requested
@@ -186,52 +447,165 @@ Scrobble: {str(self.scrobble)}
             return root
 
         # Return a list of the elements with the specified type
-        return list(root.iter(tag='{http://subsonic.org/restapi}' + list_type))
+        if incremental:
+            return iter(list(root.iter(tag=response.SUBSONIC_NS + list_type)))
+        return list(root.iter(tag=response.SUBSONIC_NS + list_type))
+
+    def _iter_response(self, r: requests.Response, endpoint: str, list_type: str, latency: float,
+                       retries: int) -> Iterator[Element]:
+        """Yield the matching elements from a streamed response, closing the
+        connection once the response has been read or abandoned. """
+
+        # Let urllib3 undo any gzip transfer encoding for us
+        r.raw.decode_content = True
+        source = response.CountingReader(r.raw)
+        parse_started = time.monotonic()
+        failed = True
+        try:
+            yield from response.iterparse(source, response.SUBSONIC_NS + list_type)
+            failed = False
+        except GeneratorExit:
+            # The caller stopped early, which is not a failure
+            failed = False
+            raise
+        finally:
+            r.close()
+            self.metrics.record(endpoint, latency, source.bytes_read, time.monotonic() - parse_started, retries,
+                                failed=failed)
+
+    async def asub_request(self,
+                           page: str = "ping",
+                           list_type: str = 'subsonic-response',
+                           extras: dict = None,
+                           timeout: int = 10,
+                           return_root: bool = False) -> Union[List[Element], Element, str]:
+        """Awaitable version of sub_request. Takes the same arguments and
+        returns the same results. No more requests to this server run at
+        once than its limiter allows, however many coroutines are waiting."""
+
+        request = functools.partial(self.sub_request, page, list_type, extras, timeout, return_root)
+
+        # Generating a stream URL doesn't touch the network
+        if page == "stream":
+            return request()
 
-    def go_online(self) -> None:
-        """Ping the server to ensure it is online, if it is load the
-        pickle or generate the local cache if necessary. """
+        if self.async_executor is None:
+            self.async_executor = ThreadPoolExecutor(max_workers=self.limiter.max_limit,
+                                                     thread_name_prefix=f"pysonic-{self.server_name}")
+        return await asyncio.get_running_loop().run_in_executor(self.async_executor, request)
+
+    def ask_password(self) -> None:
+        """Prompt for the password if it isn't stored in the config. """
 
         if self.password == "":
-            self.password = (b"enc:" + hexlify(bytes(getpass.getpass(), encoding="utf8"))).decode('utf-8')
+            self.password = (b"enc:" + hexlify(bytes(getpass.getpass(f"Password for {self.server_name}: "),
+                                                     encoding="utf8"))).decode('utf-8')
 
-        sys.stdout.write(f"Checking if server {self.server_name} is online: ")
-        sys.stdout.flush()
+    def go_online(self, background_refresh: bool = False) -> None:
+        """Ping the server to ensure it is online, if it is load the
+        saved library or generate the local cache if necessary. Every line
+        printed names the server, so several servers can go online at once.
+
+        With background_refresh, a library saved on disk is used straight
+        away and the server is checked and the library updated in a
+        background thread. """
+
+        self.ask_password()
+
+        if background_refresh:
+            library = self.load_library()
+            if library is not None:
+                self.library = library
+                self.online = True
+                print(f"Loaded saved library for {self.server_name}, refreshing it in the background.")
+                threading.Thread(target=self.refresh_library, name=f"pysonic-refresh-{self.server_name}",
+                                 daemon=True).start()
+                return
 
         # Don't add the server to our server list if it crashes out
-        try:
-            self.sub_request(timeout=2)
-        except (PysonicException, ValueError):
+        if not self.ping():
             self.online = False
+            print(f"Checking if server {self.server_name} is online: No")
             return
 
         self.online = True
-        sys.stdout.write('Yes\n')
-        sys.stdout.flush()
+        print(f"Checking if server {self.server_name} is online: Yes")
 
-        # Try to load the pickle, build the library if necessary
-        need_new_build = False
-        try:
-            self.library = pickle.load(open(self.pickle_file, "rb"))
-        except IOError:
-            need_new_build = True
-        except (EOFError, TypeError, AttributeError, pickle.UnpicklingError):
-            print("Library archive corrupt or generated by old version of pysonic. Rebuilding library.")
-            need_new_build = True
-
-        if need_new_build:
+        # Try to load the saved library, build the library if necessary
+        library = self.load_library()
+        if library is None:
             self.library = pysonic.Library(self)
-            sys.stdout.write("Building library.")
+            print(f"Building library for {self.server_name}:")
             self.library.fill_artists()
             self.pickle()
-            print("")
+        else:
+            self.library = library
 
         # Update the server that the songs use
         self.library.update_server(self)
         # Update the library in the background
         if self.library.update_library() > 0:
-            print("Saving new library.")
+            print(f"Saving new library for {self.server_name}.")
             self.pickle()
+            threading.Thread(target=self.refresh_folder, args=(self.library, False),
+                             name=f"pysonic-folders-{self.server_name}", daemon=True).start()
+
+    def ping(self) -> bool:
+        """Check whether the server is reachable and accepts our login. """
+
+        try:
+            self.sub_request(timeout=2)
+        except (PysonicException, ValueError, requests.RequestException):
+            return False
+        return True
+
+    def refresh_library(self) -> None:
+        """Update a copy of the library with the server's changes, save it,
+        and then swap it in for the library in use. Commands keep using the
+        old library until the swap. """
+
+        if not self.ping():
+            print(f"\nServer {self.server_name} is not responding, using its saved library.")
+            return
+
+        # Work on a separate copy so that the library in use is never half updated
+        library = self.load_library()
+        if library is None:
+            return
+        changes = library.update_library(verbose=False)
+        if changes > 0:
+            self.pickle(library)
+
+        # Carry over anything created since the library was loaded
+        current = self.library
+        library.prev_res = current.prev_res
+        if library.folder is None:
+            library.folder = current.folder
+        self.library = library
+        if changes > 0:
+            print(f"\nLibrary for {self.server_name} refreshed with {changes} changes.")
+            self.refresh_folder(library, verbose=False)
+
+    def refresh_folder(self, library: 'pysonic.Library' = None, verbose: bool = True) -> None:
+        """Fetch the directories changed on the server into the folder
+        hierarchy of the library (or the library in use), save it, and
+        report how many directories were skipped and fetched again. Show
+        the progress if verbose. """
+
+        if library is None:
+            library = self.library
+
+        refreshed = library.refresh_folder(verbose)
+        if refreshed is None:
+            if verbose:
+                print(f"No folders built for {self.server_name} yet, use the folder command to build them.")
+            return
+        self.pickle(library)
+        skipped, refetched = refreshed
+        message = (f"Folders for {self.server_name} refreshed: {refetched} directories fetched again, "
+                   f"{skipped} unchanged directories skipped.")
+        # Start on a new line in the background, as the prompt is on the current one
+        print(message if verbose else "\n" + message)
 
     def __repr__(self) -> str:
         return f"Server(server_url='{self.server_url}')"
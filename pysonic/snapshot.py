@@ -0,0 +1,535 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pysonic
+from pysonic import utils
+
+# Bump the version whenever the layout changes; older files are then rebuilt
+MAGIC = b"PYSNAPSH"
+VERSION = 1
+
+# Flags stored in the header
+FLAG_COMPRESSED = 1
+FLAG_BIG_ENDIAN = 2
+
+# The header is followed by an (offset, length) entry for every section, in this order
+HEADER = struct.Struct("<8sHHI")
+SECTION = struct.Struct("<QQ")
+SECTIONS = ('meta', 'blocks', 'records',
+            'artists', 'albums', 'songs', 'folders', 'folder_songs',
+            'artists_ids', 'albums_ids', 'songs_ids',
+            'artists_names', 'albums_names', 'songs_names',
+            'artists_starts', 'albums_starts', 'songs_starts')
+
+# Every record table holds these four unsigned ints per record
+RECORD_FIELDS = 4
+NO_PARENT = 0xFFFFFFFF
+
+# Records are packed into blocks of about this size, which are compressed separately
+BLOCK_SIZE = 64 * 1024
+# How many decompressed blocks to keep
+BLOCK_CACHE_SIZE = 64
+
+# Which attribute of each searchable table is searched
+NAME_FIELDS = {'artists': 'name', 'albums': 'name', 'songs': 'title'}
+
+# The journal is written into a new snapshot once it is larger than this share of the snapshot, and this size
+JOURNAL_SHARE = 0.25
+JOURNAL_MINIMUM = 1024 * 1024
+
+
+class _RecordWriter(object):
+    """Packs records into blocks while a snapshot is written. """
+
+    def __init__(self, compress: bool):
+        self.compress = compress
+        self.blocks: List[bytes] = []
+        self.current = bytearray()
+
+    def add(self, data_dict: Optional[dict], parent: int) -> Tuple[int, int, int, int]:
+        """Add a record, returning its entry for a record table. """
+
+        raw = json.dumps(data_dict, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if self.current and len(self.current) + len(raw) > BLOCK_SIZE:
+            self.flush()
+        entry = (len(self.blocks), len(self.current), len(raw), parent)
+        self.current += raw
+        return entry
+
+    def flush(self) -> None:
+        if self.current:
+            self.blocks.append(zlib.compress(bytes(self.current)) if self.compress else bytes(self.current))
+            self.current = bytearray()
+
+
+def _artist_entry(one_artist: Optional['pysonic.Artist']) -> Optional[dict]:
+    if one_artist is None:
+        return None
+    return {'data': one_artist.data_dict,
+            'albums': [[x.data_dict, [y.data_dict for y in x]] for x in one_artist]}
+
+
+def _load_artist_entry(entry: Optional[dict], server: 'pysonic.Server') -> Optional['pysonic.Artist']:
+    if entry is None:
+        return None
+    one_artist = pysonic.Artist(server=server, data_dict=entry['data'])
+    one_artist.albums = [pysonic.Album(data_dict, server=server, songs=songs) for data_dict, songs in entry['albums']]
+    return one_artist
+
+
+def _folder_entry(one_folder: Optional['pysonic.Folder']) -> Optional[dict]:
+    if one_folder is None:
+        return None
+    return {'data': one_folder.data_dict, 'songs': [x.data_dict for x in one_folder.songs],
+            'children': [_folder_entry(x) for x in one_folder.children]}
+
+
+def _load_folder_entry(entry: Optional[dict], server: 'pysonic.Server') -> Optional['pysonic.Folder']:
+    if entry is None:
+        return None
+    return pysonic.Folder(server=server, data_dict=entry['data'],
+                          children=[_load_folder_entry(x, server) for x in entry['children']],
+                          songs=[pysonic.Song(x, server=server) for x in entry['songs']])
+
+
+class Snapshot(object):
+    """Keeps a library in a versioned binary snapshot file. The file is
+    memory-mapped and records are only decoded when they are used, so
+    opening it takes the same time whatever the size of the library.
+
+    The file holds each record (the attribute dictionary of an artist,
+    album, song or folder) as JSON, packed into blocks that may be
+    compressed. Fixed-width tables give the position and parent of every
+    record, the records sorted by a hash of their ID, and the lower-cased
+    names of everything searchable. Albums follow their artist and songs
+    follow their album, so the children of a record are found by binary
+    search. Has the same interface as SQLiteStore and is safe to use from
+    several threads.
+
+    Changes saved after the snapshot was written are appended to a journal
+    next to it, one JSON entry per line, so that saving them costs what
+    the changes cost. The journal holds whole artists (or their removal),
+    the folder hierarchy and the library attributes, and goes away when
+    the next snapshot is written. Every entry names the snapshot it was
+    written for, so that entries left over from an older one are never
+    applied to a newer one. """
+
+    # Changes are journaled over the snapshot until the next one is written
+    journaled = True
+
+    def __init__(self, path: str, compress: bool = False):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compress = compress
+        self._map: Optional[mmap.mmap] = None
+        self._views: Dict[str, memoryview] = {}
+        self._sections: Dict[str, Tuple[int, int]] = {}
+        self._flags = 0
+        # Identifies the snapshot file, so that journal entries written for an older one are told apart
+        self._stamp: Optional[str] = None
+        self._blocks: OrderedDict = OrderedDict()
+        self._objects: Dict[Tuple[str, int], object] = {}
+        self._lock = threading.RLock()
+
+    def _open(self) -> bool:
+        """Map the file if it isn't mapped yet. Return whether there is a
+        snapshot. Raises ValueError if the file is not a usable snapshot. """
+
+        if self._map is not None:
+            return True
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return False
+
+        with open(self.path, "rb") as snapshot_file:
+            mapped = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, section_count = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a library snapshot.")
+        if version != VERSION or section_count != len(SECTIONS):
+            raise ValueError(f"{self.path} was written by another version of pysonic.")
+        if bool(flags & FLAG_BIG_ENDIAN) != (sys.byteorder == 'big'):
+            raise ValueError(f"{self.path} was written on a machine with another byte order.")
+
+        sections = {}
+        for position, name in enumerate(SECTIONS):
+            sections[name] = SECTION.unpack_from(mapped, HEADER.size + position * SECTION.size)
+        view = memoryview(mapped)
+        views = {name: view[offset:offset + length] for name, (offset, length) in sections.items()}
+        for name in SECTIONS:
+            if name == 'blocks':
+                views[name] = views[name].cast('Q')
+            elif name not in ('meta', 'records') and not name.endswith('_names'):
+                views[name] = views[name].cast('I')
+
+        self._map, self._sections, self._views, self._flags = mapped, sections, views, flags
+        self._stamp = json.loads(bytes(views['meta'])).get('stamp')
+        self._blocks.clear()
+        self._objects.clear()
+        return True
+
+    def _release(self) -> None:
+        """Forget the mapped file. Views still held elsewhere keep their
+        mapping alive until they are dropped. """
+
+        self._map = None
+        self._views = {}
+        self._sections = {}
+        self._stamp = None
+        self._blocks.clear()
+        self._objects.clear()
+
+    def is_empty(self) -> bool:
+        """Whether no library has been saved yet. """
+
+        with self._lock:
+            return not self._open()
+
+    def clear(self) -> None:
+        """Remove the saved library. """
+
+        with self._lock:
+            self._release()
+            for one_file in (self.path, self.journal_path):
+                if os.path.exists(one_file):
+                    os.unlink(one_file)
+
+    def save(self, library: 'pysonic.Library') -> None:
+        """Write the library to a new snapshot, replacing the old one and
+        its journal. """
+
+        with self._lock:
+            records = _RecordWriter(self.compress)
+            tables = {name: array('I') for name in ('artists', 'albums', 'songs', 'folders', 'folder_songs')}
+
+            album_position = 0
+            for artist_position, one_artist in enumerate(library.artists):
+                tables['artists'].extend(records.add(one_artist.data_dict, NO_PARENT))
+                for one_album in one_artist:
+                    tables['albums'].extend(records.add(one_album.data_dict, artist_position))
+                    for one_song in one_album:
+                        tables['songs'].extend(records.add(one_song.data_dict, album_position))
+                    album_position += 1
+
+            # Folders are written depth first, parents always before their children
+            pending = [(library.folder, NO_PARENT)] if library.folder is not None else []
+            while pending:
+                one_folder, parent = pending.pop()
+                position = len(tables['folders']) // RECORD_FIELDS
+                tables['folders'].extend(records.add(one_folder.data_dict, parent))
+                for one_song in one_folder.songs:
+                    tables['folder_songs'].extend(records.add(one_song.data_dict, position))
+                pending.extend((x, position) for x in reversed(one_folder.children))
+            records.flush()
+
+            sections = {'meta': json.dumps({'last_update': library.last_update,
+                                            'server_modified': getattr(library, 'server_modified', None),
+                                            'stamp': utils.salt_generator(16)}).encode('utf-8'),
+                        'records': b"".join(records.blocks)}
+            block_table = array('Q')
+            offset = 0
+            for one_block in records.blocks:
+                block_table.extend((offset, len(one_block)))
+                offset += len(one_block)
+            sections['blocks'] = block_table.tobytes()
+            sections.update({name: table.tobytes() for name, table in tables.items()})
+
+            items = {'artists': library.artists,
+                     'albums': [x for y in library.artists for x in y],
+                     'songs': [x for y in library.artists for z in y for x in z]}
+            for name, objects in items.items():
+                ids = sorted((zlib.crc32(x.data_dict['id'].encode('utf-8')), position)
+                             for position, x in enumerate(objects))
+                sections[f'{name}_ids'] = array('I', [x for pair in ids for x in pair]).tobytes()
+                # Names are separated by NUL, which never occurs in a name, so a match can't span two
+                names = [(x.data_dict.get(NAME_FIELDS[name]) or "").lower().encode('utf-8') for x in objects]
+                starts = array('I')
+                position = 0
+                for one_name in names:
+                    starts.append(position)
+                    position += len(one_name) + 1
+                sections[f'{name}_names'] = b"\0".join(names) + b"\0"
+                sections[f'{name}_starts'] = starts.tobytes()
+
+            flags = (FLAG_COMPRESSED if self.compress else 0) | (FLAG_BIG_ENDIAN if sys.byteorder == 'big' else 0)
+            temp_file = self.path + ".tmp"
+            with open(temp_file, "wb") as snapshot_file:
+                offset = HEADER.size + SECTION.size * len(SECTIONS)
+                snapshot_file.write(HEADER.pack(MAGIC, VERSION, flags, len(SECTIONS)))
+                for name in SECTIONS:
+                    # Keep every section aligned for the tables mapped over it
+                    offset += -offset % 8
+                    snapshot_file.write(SECTION.pack(offset, len(sections[name])))
+                    offset += len(sections[name])
+                for name in SECTIONS:
+                    snapshot_file.write(b"\0" * (-snapshot_file.tell() % 8))
+                    snapshot_file.write(sections[name])
+            os.replace(temp_file, self.path)
+            # Entries left behind by a crash here are for the old snapshot, and are skipped when the journal is read
+            if os.path.exists(self.journal_path):
+                os.unlink(self.journal_path)
+            self._release()
+
+    def save_changes(self, library: 'pysonic.Library', artists: Dict[str, Optional['pysonic.Artist']],
+                     folder: bool) -> None:
+        """Append changes made to the library since it was last saved to
+        the journal: the changed artists by ID, None for those removed, and
+        the folder hierarchy if folder is set. """
+
+        entries = [{'op': 'artist', 'id': artist_id, 'artist': _artist_entry(one_artist)}
+                   for artist_id, one_artist in artists.items()]
+        if folder:
+            entries.append({'op': 'folder', 'folder': _folder_entry(library.folder)})
+        entries.append({'op': 'meta', 'last_update': library.last_update,
+                        'server_modified': getattr(library, 'server_modified', None)})
+
+        with self._lock:
+            self._open()
+            lines = b"".join(json.dumps({**x, 'snapshot': self._stamp}, ensure_ascii=False,
+                                        separators=(',', ':')).encode('utf-8') + b"\n" for x in entries)
+            with open(self.journal_path, "a+b") as journal_file:
+                # Drop the end of an entry cut short by a crash, so that it doesn't run into the next one
+                if journal_file.tell():
+                    journal_file.seek(-1, os.SEEK_END)
+                    if journal_file.read(1) != b"\n":
+                        journal_file.seek(0)
+                        journal_file.truncate(journal_file.read().rfind(b"\n") + 1)
+                journal_file.write(lines)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def load_journal(self, server: 'pysonic.Server') -> dict:
+        """Return the changes saved since the snapshot was written: the
+        library attributes, each changed artist in order as (ID, artist or
+        None if removed), and the folder hierarchy if it changed. Entries
+        written for an older snapshot are skipped. Raises ValueError if the
+        journal is unreadable. """
+
+        res = {'meta': {}, 'artists': []}
+        with self._lock:
+            self._open()
+            stamp = self._stamp
+            try:
+                with open(self.journal_path, "rb") as journal_file:
+                    lines = journal_file.read().split(b"\n")
+            except FileNotFoundError:
+                return res
+
+        # The last line is empty, or an entry cut short by a crash
+        for line in lines[:-1]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                raise ValueError(f"{self.journal_path} is corrupt.")
+            if entry.get('snapshot') != stamp:
+                continue
+            if entry['op'] == 'artist':
+                res['artists'].append((entry['id'], _load_artist_entry(entry['artist'], server)))
+            elif entry['op'] == 'folder':
+                res['folder'] = _load_folder_entry(entry['folder'], server)
+            elif entry['op'] == 'meta':
+                res['meta'] = {'last_update': entry['last_update'], 'server_modified': entry['server_modified']}
+        return res
+
+    def needs_compaction(self) -> bool:
+        """Whether the journal has grown enough to be worth writing a new
+        snapshot. """
+
+        with self._lock:
+            if not os.path.exists(self.journal_path):
+                return False
+            base = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            return os.path.getsize(self.journal_path) > max(JOURNAL_MINIMUM, base * JOURNAL_SHARE)
+
+    def _block(self, block: int) -> bytes:
+        """Return the decompressed contents of a block. """
+
+        if block in self._blocks:
+            self._blocks.move_to_end(block)
+            return self._blocks[block]
+        base = self._sections['records'][0]
+        offset, length = self._views['blocks'][2 * block], self._views['blocks'][2 * block + 1]
+        data = zlib.decompress(self._map[base + offset:base + offset + length])
+        self._blocks[block] = data
+        if len(self._blocks) > BLOCK_CACHE_SIZE:
+            self._blocks.popitem(last=False)
+        return data
+
+    def _record(self, table: str, position: int) -> Optional[dict]:
+        """Decode one record of a table. """
+
+        entries = self._views[table]
+        block, offset, length = entries[RECORD_FIELDS * position:RECORD_FIELDS * position + 3]
+        if self._flags & FLAG_COMPRESSED:
+            raw = self._block(block)[offset:offset + length]
+        else:
+            # Uncompressed records are read straight out of the mapped file
+            start = self._sections['records'][0] + self._views['blocks'][2 * block] + offset
+            raw = self._map[start:start + length]
+        return json.loads(raw)
+
+    def _count(self, table: str) -> int:
+        return len(self._views[table]) // RECORD_FIELDS
+
+    def _children(self, table: str, parent: int) -> range:
+        """Return the positions of the records of a table with the given
+        parent. Only for tables kept in the order of their parents. """
+
+        parents = self._views[table][RECORD_FIELDS - 1::RECORD_FIELDS]
+        return range(bisect_left(parents, parent), bisect_right(parents, parent))
+
+    def load_meta(self) -> dict:
+        """Return the library attributes saved along with it. """
+
+        with self._lock:
+            if not self._open():
+                return {}
+            meta = json.loads(bytes(self._views['meta']))
+            meta.pop('stamp', None)
+            return meta
+
+    def load_artists(self, server: 'pysonic.Server') -> List['pysonic.Artist']:
+        """Load the whole artist, album and song hierarchy. The objects are
+        new every time, so that a library can change its hierarchy without
+        changing that of another library read from the same snapshot. """
+
+        with self._lock:
+            if not self._open():
+                return []
+            return [self._new_artist(x, server) for x in range(self._count('artists'))]
+
+    def load_folder(self, server: 'pysonic.Server') -> Optional['pysonic.Folder']:
+        """Load the folder hierarchy, if one was saved. """
+
+        with self._lock:
+            if not self._open() or not self._count('folders'):
+                return None
+            songs: Dict[int, List['pysonic.Song']] = {}
+            for position in range(self._count('folder_songs')):
+                parent = self._views['folder_songs'][RECORD_FIELDS * position + RECORD_FIELDS - 1]
+                songs.setdefault(parent, []).append(pysonic.Song(self._record('folder_songs', position),
+                                                                 server=server))
+            folders = []
+            for position in range(self._count('folders')):
+                one_folder = pysonic.Folder(server=server, data_dict=self._record('folders', position),
+                                            children=[], songs=songs.get(position, []))
+                folders.append(one_folder)
+                parent = self._views['folders'][RECORD_FIELDS * position + RECORD_FIELDS - 1]
+                if parent != NO_PARENT:
+                    folders[parent].children.append(one_folder)
+            return folders[0]
+
+    def records(self, table: str) -> Iterator[dict]:
+        """Yield the attribute dictionaries of all the artists, albums or
+        songs in library order, without creating objects for them. """
+
+        with self._lock:
+            if not self._open():
+                return
+            for position in range(self._count(table)):
+                yield self._record(table, position)
+
+    def _song(self, position: int, server: 'pysonic.Server') -> 'pysonic.Song':
+        key = ('songs', position)
+        if key not in self._objects:
+            self._objects[key] = pysonic.Song(self._record('songs', position), server=server)
+        return self._objects[key]
+
+    def _new_album(self, position: int, server: 'pysonic.Server') -> 'pysonic.Album':
+        songs = [self._record('songs', x) for x in self._children('songs', position)]
+        return pysonic.Album(self._record('albums', position), server=server, songs=songs)
+
+    def _new_artist(self, position: int, server: 'pysonic.Server') -> 'pysonic.Artist':
+        one_artist = pysonic.Artist(server=server, data_dict=self._record('artists', position))
+        one_artist.albums = [self._new_album(x, server) for x in self._children('albums', position)]
+        return one_artist
+
+    def _album(self, position: int, server: 'pysonic.Server') -> 'pysonic.Album':
+        key = ('albums', position)
+        if key not in self._objects:
+            self._objects[key] = self._new_album(position, server)
+        return self._objects[key]
+
+    def _artist(self, position: int, server: 'pysonic.Server') -> 'pysonic.Artist':
+        key = ('artists', position)
+        if key not in self._objects:
+            self._objects[key] = self._new_artist(position, server)
+        return self._objects[key]
+
+    def _matching(self, table: str, search: str) -> List[int]:
+        """Return the positions of the records of a table whose name
+        contains the query, ignoring case, in library order. """
+
+        if not self._open():
+            return []
+        needle = search.lower().encode('utf-8')
+        starts = self._views[f'{table}_starts']
+        start, length = self._sections[f'{table}_names']
+        end = start + length
+
+        res = []
+        found = self._map.find(needle, start, end)
+        while found != -1:
+            position = bisect_right(starts, found - start) - 1
+            res.append(position)
+            # Carry on from the next name, so that each record matches once
+            following = starts[position + 1] if position + 1 < len(starts) else length
+            found = self._map.find(needle, start + following, end)
+        return res
+
+    def _find(self, table: str, item_id: str) -> Optional[int]:
+        """Return the position of the record of a table with an ID. """
+
+        if not self._open():
+            return None
+        item_id = str(item_id)
+        ids = self._views[f'{table}_ids']
+        hashes = ids[0::2]
+        hashed = zlib.crc32(item_id.encode('utf-8'))
+        for position in range(bisect_left(hashes, hashed), bisect_right(hashes, hashed)):
+            # Different IDs may share a hash, so check the record itself
+            if self._record(table, ids[2 * position + 1])['id'] == item_id:
+                return ids[2 * position + 1]
+        return None
+
+    def search_songs(self, search: str, server: 'pysonic.Server') -> List['pysonic.Song']:
+        with self._lock:
+            return [self._song(x, server) for x in self._matching('songs', search)]
+
+    def search_albums(self, search: str, server: 'pysonic.Server') -> List['pysonic.Album']:
+        with self._lock:
+            return [self._album(x, server) for x in self._matching('albums', search)]
+
+    def search_artists(self, search: str, server: 'pysonic.Server') -> List['pysonic.Artist']:
+        with self._lock:
+            return [self._artist(x, server) for x in self._matching('artists', search)]
+
+    def get_song(self, song_id: str, server: 'pysonic.Server') -> Optional['pysonic.Song']:
+        with self._lock:
+            position = self._find('songs', song_id)
+            return self._song(position, server) if position is not None else None
+
+    def get_album(self, album_id: str, server: 'pysonic.Server') -> Optional['pysonic.Album']:
+        with self._lock:
+            position = self._find('albums', album_id)
+            return self._album(position, server) if position is not None else None
+
+    def get_artist(self, artist_id: str, server: 'pysonic.Server') -> Optional['pysonic.Artist']:
+        with self._lock:
+            position = self._find('artists', artist_id)
+            return self._artist(position, server) if position is not None else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._release()
+
+    def __repr__(self) -> str:
+        return f"Snapshot(path='{self.path}', compress={self.compress})"
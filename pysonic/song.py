@@ -1,24 +1,35 @@
-from typing import List
+from typing import List, Optional
 
 import pysonic
 import pysonic.lyrics
 import pysonic.utils as utils
 
+# The song attributes that are kept; the rest of what the server sends is dropped
+SONG_FIELDS = ('id', 'title', 'album', 'artist', 'albumId', 'artistId', 'duration', 'track', 'discNumber',
+               'genre')
+
 
 class Song(object):
     """This class implements the logical concept of a song. """
 
-    data_dict = None
+    __slots__ = ('server', 'data_dict')
 
     def __init__(self, data_dict, server: 'pysonic.Server' = None):
         """We need the dictionary to create a song. """
 
         self.server = server
         if data_dict:
-            self.data_dict = data_dict
+            self.data_dict = utils.compact(data_dict, SONG_FIELDS)
         else:
             raise ValueError('You must pass the song dictionary to create a song.')
 
+    def __setstate__(self, state: dict) -> None:
+        # Songs pickled by older versions have an instance dictionary rather than slots
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self.server = state.get('server')
+        self.data_dict = utils.compact(state['data_dict'], SONG_FIELDS)
+
     def update_server(self, server: 'pysonic.Server') -> None:
         """Update the server this song is linked to. """
 
@@ -60,19 +71,28 @@ class Song(object):
     def __repr__(self) -> str:
         return f"Song(title='{self.data_dict.get('title')}', id={self.data_dict.get('id')})"
 
-    def get_details(self, show_header: bool = False):
-        """Print in a columnar mode that works well with multiple songs. """
+    def get_details(self, show_header: bool = False, score: Optional[float] = None, source: Optional[str] = None):
+        """Print in a columnar mode that works well with multiple songs. If
+        there is a score, show it as how closely the song matched, and if
+        there is a source, the server it comes from. """
+
+        prefix_format, header, prefix = "", (), ()
+        if score is not None:
+            prefix_format, header, prefix = "%-5s|", ("Match",), ("%d%%" % round(score * 100),)
+        if source is not None:
+            prefix_format += "%-10s|"
+            header += ("Server",)
+            prefix += (source[:10],)
 
-        total_space = utils.get_width(21)
+        total_space = utils.get_width(21 + len(prefix_format % header))
         available_space = int(total_space / 3)
         remainder = total_space % 3
 
+        format_string = f"%-6s|%-5s|%-5s|%-{available_space}s|%-{available_space}s|%-{available_space + remainder}s"
         if show_header:
-            header_format = f"%-6s|%-5s|%-5s|%-{available_space}s|%-{available_space}s|%-{available_space + remainder}s"
-            print(header_format % ("SongID", "AlbID", "ArtID", "Song", "Album", "Artist"))
+            print(prefix_format % header + format_string % ("SongID", "AlbID", "ArtID", "Song", "Album", "Artist"))
 
-        format_string = f"%-6s|%-5s|%-5s|%-{available_space}s|%-{available_space}s|%-{available_space + remainder}s"
-        return format_string % (
+        return prefix_format % prefix + format_string % (
             utils.clean_get(self, 'id'),
             utils.clean_get(self, 'albumId'),
             utils.clean_get(self, 'artistId'),
@@ -106,16 +126,20 @@ class Song(object):
         return res
 
 
-def print_song_list(song_list: List['pysonic.Song']) -> None:
-    """ Nicely formats and prints a list of songs. """
+def print_song_list(song_list: List['pysonic.Song'], scores: Optional[List[float]] = None,
+                    sources: Optional[List[str]] = None) -> None:
+    """ Nicely formats and prints a list of songs, with how closely each
+    matched if there are scores, and the server each comes from if there
+    are sources. """
 
     if len(song_list) == 0:
         print("No songs matched your query.")
         return
     if utils.get_width() >= 80:
         show_header = True
-        for one_song in song_list:
-            print(one_song.get_details(show_header=show_header))
+        for position, one_song in enumerate(song_list):
+            print(one_song.get_details(show_header=show_header, score=scores[position] if scores else None,
+                                       source=sources[position] if sources else None))
             show_header = False
     else:
         print("For optimal song display, please resize terminal to be at least 80 characters wide.")
@@ -0,0 +1,347 @@
+import json
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pysonic
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS artists (seq INTEGER PRIMARY KEY, id TEXT NOT NULL, name TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS albums (seq INTEGER PRIMARY KEY, id TEXT NOT NULL, artist_seq INTEGER NOT NULL,
+                                   name TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS songs (seq INTEGER PRIMARY KEY, id TEXT NOT NULL, album_seq INTEGER NOT NULL,
+                                  title TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS folders (seq INTEGER PRIMARY KEY, parent_seq INTEGER, data TEXT);
+CREATE TABLE IF NOT EXISTS folder_songs (seq INTEGER PRIMARY KEY, folder_seq INTEGER NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS artists_id ON artists (id);
+CREATE INDEX IF NOT EXISTS albums_id ON albums (id);
+CREATE INDEX IF NOT EXISTS albums_artist ON albums (artist_seq);
+CREATE INDEX IF NOT EXISTS songs_id ON songs (id);
+CREATE INDEX IF NOT EXISTS songs_album ON songs (album_seq);
+"""
+
+# The trigram tokenizer lets the full text index answer the same case-insensitive
+#  substring searches that the in-memory library does
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS artists_fts USING fts5(name, content='artists', content_rowid='seq',
+                                                          tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS albums_fts USING fts5(name, content='albums', content_rowid='seq',
+                                                         tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(title, content='songs', content_rowid='seq',
+                                                        tokenize='trigram');
+"""
+
+# Which text column is searched in each table
+SEARCH_COLUMNS = {'artists': 'name', 'albums': 'name', 'songs': 'title'}
+
+
+class SQLiteStore(object):
+    """Keeps a library in an SQLite database rather than a snapshot. Lookups
+    by ID and name searches run as indexed queries, so a library doesn't
+    have to be loaded in full to be used. Objects are only created for the
+    rows that are asked for, and the same row always gives back the same
+    object. Safe to use from several threads. """
+
+    # Changes are written in place, so nothing is ever journaled over the store
+    journaled = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or older than 3.34; search by scanning instead
+            self.full_text = False
+        self.connection.commit()
+        self._objects: Dict[Tuple[str, str], object] = {}
+        self._lock = threading.RLock()
+
+    def is_empty(self) -> bool:
+        """Whether no library has been saved yet. """
+
+        with self._lock:
+            return self.connection.execute("SELECT count(*) FROM meta").fetchone()[0] == 0
+
+    def clear(self) -> None:
+        """Remove the saved library. """
+
+        with self._lock, self.connection:
+            for table in ('meta', 'artists', 'albums', 'songs', 'folders', 'folder_songs'):
+                self.connection.execute(f"DELETE FROM {table}")
+            if self.full_text:
+                for table in SEARCH_COLUMNS:
+                    self.connection.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+            self._objects.clear()
+
+    def save(self, library: 'pysonic.Library') -> None:
+        """Write the library to the database, replacing what was there. Only
+        the parts of the library that have been loaded are written. """
+
+        with self._lock, self.connection:
+            cursor = self.connection.cursor()
+            if library.loaded:
+                self._save_artists(cursor, library.artists)
+            if library.folder_loaded:
+                self._save_folder(cursor, library.folder)
+            self._save_meta(cursor, library)
+            self._objects.clear()
+
+    def save_changes(self, library: 'pysonic.Library', artists: Dict[str, Optional['pysonic.Artist']],
+                     folder: bool) -> None:
+        """Write changes made to the library since it was last saved: the
+        changed artists by ID, None for those removed, and the folder
+        hierarchy if folder is set. The rows of the changed artists are
+        changed in place. """
+
+        with self._lock, self.connection:
+            cursor = self.connection.cursor()
+            for artist_id, one_artist in artists.items():
+                self._replace_artist(cursor, artist_id, one_artist)
+            if folder:
+                self._save_folder(cursor, library.folder)
+            self._save_meta(cursor, library)
+            self._objects.clear()
+
+    def load_journal(self, server: 'pysonic.Server') -> dict:
+        """Changes are written to the database straight away, so there are
+        never any left to apply. """
+
+        return {'meta': {}, 'artists': []}
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    @staticmethod
+    def _save_meta(cursor: sqlite3.Cursor, library: 'pysonic.Library') -> None:
+        cursor.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           [('last_update', json.dumps(library.last_update)),
+                            ('server_modified', json.dumps(getattr(library, 'server_modified', None)))])
+
+    @staticmethod
+    def _artist_rows(one_artist: 'pysonic.Artist', artist_seq: int, album_seq: int,
+                     song_seq: int) -> Tuple[tuple, List[tuple], List[tuple]]:
+        """Return the rows of an artist, its albums and their songs, numbered
+        from the given sequence numbers. """
+
+        album_rows, song_rows = [], []
+        for one_album in one_artist:
+            album_rows.append((album_seq + len(album_rows), one_album.data_dict['id'], artist_seq,
+                               one_album.data_dict.get('name'), json.dumps(one_album.data_dict)))
+            for one_song in one_album:
+                song_rows.append((song_seq + len(song_rows), one_song.data_dict['id'], album_rows[-1][0],
+                                  one_song.data_dict.get('title'), json.dumps(one_song.data_dict)))
+        artist_row = (artist_seq, one_artist.data_dict['id'], one_artist.data_dict.get('name'),
+                      json.dumps(one_artist.data_dict))
+        return artist_row, album_rows, song_rows
+
+    @staticmethod
+    def _insert_rows(cursor: sqlite3.Cursor, artist_rows: List[tuple], album_rows: List[tuple],
+                     song_rows: List[tuple]) -> None:
+        cursor.executemany("INSERT INTO artists (seq, id, name, data) VALUES (?, ?, ?, ?)", artist_rows)
+        cursor.executemany("INSERT INTO albums (seq, id, artist_seq, name, data) VALUES (?, ?, ?, ?, ?)", album_rows)
+        cursor.executemany("INSERT INTO songs (seq, id, album_seq, title, data) VALUES (?, ?, ?, ?, ?)", song_rows)
+
+    def _save_artists(self, cursor: sqlite3.Cursor, artists: List['pysonic.Artist']) -> None:
+        cursor.execute("DELETE FROM artists")
+        cursor.execute("DELETE FROM albums")
+        cursor.execute("DELETE FROM songs")
+        artist_rows, album_rows, song_rows = [], [], []
+        for one_artist in artists:
+            artist_row, new_albums, new_songs = self._artist_rows(one_artist, len(artist_rows), len(album_rows),
+                                                                  len(song_rows))
+            artist_rows.append(artist_row)
+            album_rows.extend(new_albums)
+            song_rows.extend(new_songs)
+        self._insert_rows(cursor, artist_rows, album_rows, song_rows)
+        if self.full_text:
+            for table in SEARCH_COLUMNS:
+                cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+    def _delete_rows(self, cursor: sqlite3.Cursor, table: str, where: str, parameters: tuple) -> None:
+        """Delete rows of a table, and their entries in its full text index. """
+
+        if self.full_text:
+            column = SEARCH_COLUMNS[table]
+            cursor.execute(f"INSERT INTO {table}_fts ({table}_fts, rowid, {column}) "
+                           f"SELECT 'delete', seq, {column} FROM {table} WHERE {where}", parameters)
+        cursor.execute(f"DELETE FROM {table} WHERE {where}", parameters)
+
+    def _replace_artist(self, cursor: sqlite3.Cursor, artist_id: str,
+                        one_artist: Optional['pysonic.Artist']) -> None:
+        """Replace the rows of an artist with those of its new version, or
+        remove them if it is None. A new artist goes at the end. """
+
+        row = cursor.execute("SELECT seq FROM artists WHERE id = ? ORDER BY seq LIMIT 1", (artist_id,)).fetchone()
+        if row is not None:
+            self._delete_rows(cursor, 'songs', "album_seq IN (SELECT seq FROM albums WHERE artist_seq = ?)", row)
+            self._delete_rows(cursor, 'albums', "artist_seq = ?", row)
+            self._delete_rows(cursor, 'artists', "seq = ?", row)
+        if one_artist is None:
+            return
+
+        artist_seq, album_seq, song_seq = (cursor.execute(f"SELECT coalesce(max(seq), -1) + 1 FROM {x}").fetchone()[0]
+                                           for x in ('artists', 'albums', 'songs'))
+        # Albums and songs only need to keep their order within the artist, but the artist keeps its place
+        artist_row, album_rows, song_rows = self._artist_rows(one_artist, row[0] if row else artist_seq,
+                                                              album_seq, song_seq)
+        self._insert_rows(cursor, [artist_row], album_rows, song_rows)
+        if self.full_text:
+            for table, rows in (('artists', [artist_row]), ('albums', album_rows), ('songs', song_rows)):
+                cursor.executemany(f"INSERT INTO {table}_fts (rowid, {SEARCH_COLUMNS[table]}) VALUES (?, ?)",
+                                   [(x[0], x[-2]) for x in rows])
+
+    def _save_folder(self, cursor: sqlite3.Cursor, root: Optional['pysonic.Folder']) -> None:
+        cursor.execute("DELETE FROM folders")
+        cursor.execute("DELETE FROM folder_songs")
+        if root is None:
+            return
+        folder_rows, song_rows = [], []
+        pending = [(root, None)]
+        while pending:
+            one_folder, parent = pending.pop()
+            seq = len(folder_rows)
+            folder_rows.append((seq, parent, json.dumps(one_folder.data_dict)))
+            song_rows.extend((seq, json.dumps(x.data_dict)) for x in one_folder.songs)
+            # Reversed so that the children come back out of the stack in order
+            pending.extend((x, seq) for x in reversed(one_folder.children))
+        cursor.executemany("INSERT INTO folders (seq, parent_seq, data) VALUES (?, ?, ?)", folder_rows)
+        cursor.executemany("INSERT INTO folder_songs (folder_seq, data) VALUES (?, ?)", song_rows)
+
+    def load_meta(self) -> dict:
+        """Return the library attributes saved along with it. """
+
+        with self._lock:
+            return {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM meta")}
+
+    def load_artists(self, server: 'pysonic.Server') -> List['pysonic.Artist']:
+        """Load the whole artist, album and song hierarchy. """
+
+        with self._lock:
+            songs = defaultdict(list)
+            for album_seq, data in self.connection.execute("SELECT album_seq, data FROM songs ORDER BY seq"):
+                songs[album_seq].append(json.loads(data))
+            albums = defaultdict(list)
+            for seq, artist_seq, data in self.connection.execute(
+                    "SELECT seq, artist_seq, data FROM albums ORDER BY seq"):
+                albums[artist_seq].append(pysonic.Album(json.loads(data), server=server, songs=songs[seq]))
+            artists = []
+            for seq, data in self.connection.execute("SELECT seq, data FROM artists ORDER BY seq"):
+                one_artist = pysonic.Artist(server=server, data_dict=json.loads(data))
+                one_artist.albums = albums[seq]
+                artists.append(one_artist)
+            return artists
+
+    def load_folder(self, server: 'pysonic.Server') -> Optional['pysonic.Folder']:
+        """Load the folder hierarchy, if one was saved. """
+
+        with self._lock:
+            songs = defaultdict(list)
+            for folder_seq, data in self.connection.execute(
+                    "SELECT folder_seq, data FROM folder_songs ORDER BY seq"):
+                songs[folder_seq].append(pysonic.Song(json.loads(data), server=server))
+            folders = {}
+            root = None
+            for seq, parent_seq, data in self.connection.execute(
+                    "SELECT seq, parent_seq, data FROM folders ORDER BY seq"):
+                one_folder = pysonic.Folder(server=server, data_dict=json.loads(data) if data else None,
+                                            children=[], songs=songs[seq])
+                folders[seq] = one_folder
+                if parent_seq is None:
+                    root = one_folder
+                else:
+                    folders[parent_seq].children.append(one_folder)
+            return root
+
+    def records(self, table: str) -> Iterator[dict]:
+        """Yield the attribute dictionaries of all the artists, albums or
+        songs in library order, without creating objects for them. """
+
+        with self._lock:
+            for data, in self.connection.execute(f"SELECT data FROM {table} ORDER BY seq"):
+                yield json.loads(data)
+
+    def _song(self, data: str, server: 'pysonic.Server') -> 'pysonic.Song':
+        data_dict = json.loads(data)
+        key = ('song', data_dict['id'])
+        if key not in self._objects:
+            self._objects[key] = pysonic.Song(data_dict, server=server)
+        return self._objects[key]
+
+    def _album(self, seq: int, data: str, server: 'pysonic.Server') -> 'pysonic.Album':
+        data_dict = json.loads(data)
+        key = ('album', data_dict['id'])
+        if key not in self._objects:
+            songs = [json.loads(x) for x, in self.connection.execute(
+                "SELECT data FROM songs WHERE album_seq = ? ORDER BY seq", (seq,))]
+            self._objects[key] = pysonic.Album(data_dict, server=server, songs=songs)
+        return self._objects[key]
+
+    def _artist(self, seq: int, data: str, server: 'pysonic.Server') -> 'pysonic.Artist':
+        data_dict = json.loads(data)
+        key = ('artist', data_dict['id'])
+        if key not in self._objects:
+            one_artist = pysonic.Artist(server=server, data_dict=data_dict)
+            one_artist.albums = [self._album(album_seq, album_data, server) for album_seq, album_data in
+                                 self.connection.execute("SELECT seq, data FROM albums WHERE artist_seq = ? "
+                                                         "ORDER BY seq", (seq,))]
+            self._objects[key] = one_artist
+        return self._objects[key]
+
+    def _matching_rows(self, table: str, search: str) -> List[tuple]:
+        """Return the (seq, data) rows of a table whose searched column
+        contains the query, ignoring case, in library order. """
+
+        column = SEARCH_COLUMNS[table]
+        # Trigrams can only match queries of at least three characters
+        if self.full_text and len(search) >= 3:
+            phrase = '"' + search.replace('"', '""') + '"'
+            return self.connection.execute(f"SELECT seq, data FROM {table} WHERE seq IN "
+                                           f"(SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH ?) ORDER BY seq",
+                                           (phrase,)).fetchall()
+        search = search.lower()
+        return [(seq, data) for seq, text, data in
+                self.connection.execute(f"SELECT seq, {column}, data FROM {table} ORDER BY seq")
+                if text is not None and search in text.lower()]
+
+    def search_songs(self, search: str, server: 'pysonic.Server') -> List['pysonic.Song']:
+        with self._lock:
+            return [self._song(data, server) for _, data in self._matching_rows('songs', search)]
+
+    def search_albums(self, search: str, server: 'pysonic.Server') -> List['pysonic.Album']:
+        with self._lock:
+            return [self._album(seq, data, server) for seq, data in self._matching_rows('albums', search)]
+
+    def search_artists(self, search: str, server: 'pysonic.Server') -> List['pysonic.Artist']:
+        with self._lock:
+            return [self._artist(seq, data, server) for seq, data in self._matching_rows('artists', search)]
+
+    def get_song(self, song_id: str, server: 'pysonic.Server') -> Optional['pysonic.Song']:
+        with self._lock:
+            row = self.connection.execute("SELECT data FROM songs WHERE id = ? LIMIT 1",
+                                          (str(song_id),)).fetchone()
+            return self._song(row[0], server) if row else None
+
+    def get_album(self, album_id: str, server: 'pysonic.Server') -> Optional['pysonic.Album']:
+        with self._lock:
+            row = self.connection.execute("SELECT seq, data FROM albums WHERE id = ? LIMIT 1",
+                                          (str(album_id),)).fetchone()
+            return self._album(row[0], row[1], server) if row else None
+
+    def get_artist(self, artist_id: str, server: 'pysonic.Server') -> Optional['pysonic.Artist']:
+        with self._lock:
+            row = self.connection.execute("SELECT seq, data FROM artists WHERE id = ? LIMIT 1",
+                                          (str(artist_id),)).fetchone()
+            return self._artist(row[0], row[1], server) if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+    def __repr__(self) -> str:
+        return f"SQLiteStore(path='{self.path}')"
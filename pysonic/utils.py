@@ -3,9 +3,14 @@ import random
 import re
 import stat
 import string
+import sys
+from typing import Iterable
 
 import pysonic
 
+# Creating a SystemRandom is not free, so share one
+_system_random = random.SystemRandom()
+
 
 def get_home(file_name: str = None):
     """ Returns the .pysonic directory location (full path) and
@@ -27,7 +32,7 @@ def salt_generator(size=10, chars=string.ascii_uppercase + string.digits):
     """ Generates a random ASCII string (or string from whatever source
     you provide in chars) of length size. """
 
-    return ''.join(random.SystemRandom().choice(chars) for _ in range(size))
+    return ''.join(_system_random.choices(chars, k=size))
 
 
 def clean_get(obj, key):
@@ -38,6 +43,16 @@ def clean_get(obj, key):
     return obj.data_dict.get(key, '?')
 
 
+def compact(data_dict: dict, fields: Iterable[str], unique: Iterable[str] = ('id', 'title')) -> dict:
+    """ Returns a copy of an attribute dictionary with only the given
+    fields. Values are interned, apart from those of the unique fields,
+    so the artist and album names and IDs repeated on every track are
+    only stored once. """
+
+    return {key: data_dict[key] if key in unique else sys.intern(data_dict[key])
+            for key in fields if key in data_dict}
+
+
 def get_width(used=0):
     """Get the remaining width of the terminal. """
 
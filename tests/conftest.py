@@ -0,0 +1,44 @@
+"""A local stand-in for a Subsonic server, shared by the tests. """
+
+import pytest
+
+import pysonic
+from benchmarks import synthetic
+
+PASSWORD = "sesame"
+
+
+@pytest.fixture
+def catalogue():
+    return synthetic.Catalogue(artists=5, albums=3, songs=4)
+
+
+@pytest.fixture
+def catalogue_server(catalogue):
+    """A stand-in that serves the catalogue, which a test may change. """
+
+    http_server = synthetic.SyntheticServer(catalogue, password=PASSWORD)
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+@pytest.fixture
+def make_server(catalogue_server, tmp_path):
+    """Return a function that makes a client of the catalogue server, with
+    its files kept under a directory of its own for the test. """
+
+    pysonic.state.root_dir = str(tmp_path)
+
+    def make(**kwargs) -> pysonic.Server:
+        return pysonic.Server(0, "stand-in", "user", PASSWORD, catalogue_server.url, bitrate="", **kwargs)
+
+    return make
+
+
+def tree(library: 'pysonic.Library') -> list:
+    """Return the artists, albums and songs of a library, in a form that
+    compares equal whatever their order. """
+
+    return sorted((x.data_dict['id'], x.data_dict, sorted((y.data_dict['id'], y.data_dict, [z.data_dict for z in y])
+                                                          for y in x)) for x in library)
@@ -0,0 +1,24 @@
+"""Stress Server.sub_request from many threads at once against a local
+stand-in for a Subsonic server, which checks the token of every request. """
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+REQUESTS = 3000
+THREADS = 64
+
+
+@pytest.mark.parametrize('token_reuse', [0, 60])
+def test_concurrent_requests_all_authenticate(catalogue_server, make_server, token_reuse):
+    server = make_server(workers=THREADS, token_reuse=token_reuse)
+
+    # A different ID for every request, so that none are coalesced or answered from the cache
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        results = list(pool.map(lambda x: server.sub_request(page="getMusicDirectory", list_type='child',
+                                                             extras={'id': str(x)}),
+                                range(REQUESTS)))
+
+    assert results == [[]] * REQUESTS
+    assert catalogue_server.rejected == []
+    assert sorted(catalogue_server.ids, key=int) == [str(x) for x in range(REQUESTS)]
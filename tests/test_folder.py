@@ -0,0 +1,73 @@
+"""Crawl the folder hierarchy of a stand-in server, and check the result
+is the same as the hierarchy Folder builds directory by directory. """
+
+import os
+
+import pytest
+
+import pysonic
+
+from pysonic.folder import Folder, FolderCrawl
+
+
+def shape(one_folder: Folder) -> tuple:
+    """Return a folder and everything under it in a form that compares
+    equal whatever objects they are made of. """
+
+    return (one_folder.data_dict, [x.data_dict for x in one_folder.songs],
+            sorted((shape(x) for x in one_folder.children), key=repr))
+
+
+def test_interrupted_crawl_resumes(make_server, catalogue_server, monkeypatch):
+    server = make_server()
+    expected = shape(Folder(server=server))
+    directories = catalogue_server.pages['getMusicDirectory']
+
+    fetch = FolderCrawl._fetch
+    calls = []
+
+    def interrupted(self, folder_id):
+        calls.append(folder_id)
+        if len(calls) > 7:
+            raise KeyboardInterrupt
+        return fetch(self, folder_id)
+
+    monkeypatch.setattr(FolderCrawl, '_fetch', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        FolderCrawl(server).run(verbose=False)
+    assert os.path.exists(server.crawl_file)
+    monkeypatch.setattr(FolderCrawl, '_fetch', fetch)
+
+    # Only what wasn't fetched before the interruption is fetched now
+    catalogue_server.pages.clear()
+    assert shape(FolderCrawl(server).run(verbose=False)) == expected
+    assert catalogue_server.pages['getMusicDirectory'] == directories - 7
+    assert catalogue_server.pages['getIndexes'] == 0
+    assert not os.path.exists(server.crawl_file)
+
+
+def test_refresh_fetches_changed_directories_again(make_server, catalogue_server, catalogue):
+    server = make_server()
+    # An artist directory with a timestamp, which a change in one of its albums doesn't move
+    catalogue.artists['2']['changed'] = '2020-01-01T00:00:00.000Z'
+    # Not the library in use, as when it is refreshed in the background
+    library = pysonic.Library(server)
+    library.fill_artists()
+    library.folder = FolderCrawl(server, library=library).run(verbose=False)
+
+    # A song added to an album, which only the timestamp of the album directory shows
+    song_id = str(len(catalogue.songs) + 1)
+    catalogue.songs[song_id] = {**catalogue.songs[catalogue.album_song_ids['4'][0]], 'id': song_id, 'title': 'New'}
+    catalogue.album_song_ids['4'].append(song_id)
+    catalogue.albums['4']['changed'] = '2021-06-01T00:00:00.000Z'
+    catalogue.touch()
+    catalogue_server.pages.clear()
+
+    # Every artist directory is fetched, for the timestamps of its albums, but only the changed album
+    assert library.refresh_folder(verbose=False) == (len(catalogue.albums) - 1, len(catalogue.artists) + 1)
+    assert catalogue_server.pages['getMusicDirectory'] == len(catalogue.artists) + 1
+    assert shape(library.folder) == shape(Folder(server=server))
+    album = next(x for x in library.folder.get_subfolders if x.data_dict['id'] == 'al-4')
+    assert song_id in [x.data_dict['id'] for x in album.songs]
+    # Songs come from the library refreshed
+    assert album.songs[0] is library.get_song_by_id(catalogue.album_song_ids['4'][0])
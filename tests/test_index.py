@@ -0,0 +1,79 @@
+"""The word index behind song, album and artist searches. """
+
+from pysonic import index
+
+
+def songs(*titles: str) -> index.TokenIndex:
+    res = index.TokenIndex(index.WEIGHTS['songs'])
+    res.extend({'id': str(number), 'title': title, 'artist': 'Band', 'album': 'Record'}
+               for number, title in enumerate(titles, 1))
+    return res
+
+
+def test_every_word_must_match_as_a_prefix():
+    songs_index = songs("Blue Monday", "Blue Moon", "Monday Morning")
+
+    assert [x for x, _ in songs_index.search("blue mon")] == ['1']
+    assert sorted(x for x, _ in songs_index.search("mon")) == ['1', '3']
+    assert songs_index.search("blue tuesday") == []
+
+
+def test_case_and_accents_are_ignored():
+    songs_index = songs("Déjà Vu", "ÇA IRA")
+
+    assert [x for x, _ in songs_index.search("DEJA vu")] == ['1']
+    assert [x for x, _ in songs_index.search("ça")] == ['2']
+
+
+def test_whole_words_and_titles_rank_first():
+    songs_index = songs("Running", "Run", "Something")
+    songs_index.add({'id': '4', 'title': 'Other', 'artist': 'Run', 'album': 'Record'})
+
+    found = songs_index.search("run")
+    assert [x for x, _ in found] == ['2', '4', '1']
+    assert all(0 < x <= 1 for _, x in found)
+
+
+def test_added_and_removed_items_are_found_or_not():
+    songs_index = songs("Blue Monday")
+    songs_index.add({'id': '2', 'title': 'Yellow Submarine'})
+    assert [x for x, _ in songs_index.search("yellow")] == ['2']
+
+    songs_index.remove({'id': '1', 'title': 'Blue Monday', 'artist': 'Band', 'album': 'Record'})
+    assert songs_index.search("blue") == []
+    assert songs_index.words == sorted(songs_index.postings)
+
+
+def test_saved_index_needs_the_same_stamp(tmp_path):
+    path = str(tmp_path / "library.index")
+    index.save(path, index.build({'songs': [{'id': '1', 'title': 'Blue Monday'}]}), 1234.5)
+
+    loaded = index.load(path, 1234.5)
+    assert [x for x, _ in loaded['songs'].search("monday")] == ['1']
+    assert loaded['songs'].words == ['blue', 'monday']
+    assert index.load(path, 1234.6) is None
+    assert index.load(path, None) is None
+
+
+def test_misspelled_words_find_the_closest_items():
+    songs_index = songs("Bohemian Rhapsody", "Bohemian Like You", "Stairway to Heaven")
+
+    found = songs_index.fuzzy_search("bohemain")
+    assert sorted(x for x, _ in found) == ['1', '2']
+    assert all(0 < x < 1 for _, x in found)
+    # Every query word has to stand for a word of the item, as in a search without typos
+    assert [x for x, _ in songs_index.fuzzy_search("bohemain rapsody")] == ['1']
+    assert songs_index.fuzzy_search("xyzzy") == []
+    assert len(songs_index.fuzzy_search("bohemain", limit=1)) == 1
+
+
+def test_trigrams_follow_added_and_removed_words():
+    songs_index = songs("Bohemian Rhapsody", "Stairway to Heaven")
+    songs_index.fuzzy_search("heven")
+    songs_index.add({'id': '3', 'title': 'Heavens Door'})
+    songs_index.remove({'id': '2', 'title': 'Stairway to Heaven', 'artist': 'Band', 'album': 'Record'})
+
+    assert set(songs_index.gram_counts) == set(songs_index.words) == set(songs_index.postings)
+    assert set().union(*songs_index.grams.values()) == set(songs_index.words)
+    assert [x for x, _ in songs_index.fuzzy_search("heven")] == ['3']
+    assert songs_index.fuzzy_search("stairwy") == []
@@ -0,0 +1,66 @@
+"""Save changes to a snapshot as a journal, and check the library read
+back, before and after the journal is written into a new snapshot, is
+the same as one built from scratch. """
+
+import shutil
+
+from conftest import tree
+
+
+def saved(make_server) -> 'pysonic.Server':
+    server = make_server(storage="snapshot")
+    server.library.fill_artists()
+    server.pickle()
+    return server
+
+
+def change(catalogue) -> None:
+    catalogue.artists['2']['name'] = 'Renamed'
+    del catalogue.albums['1']
+    catalogue.artists['1']['albumCount'] = '2'
+    catalogue.touch()
+
+
+def test_journal_is_replayed_and_compacted(make_server, catalogue):
+    server = saved(make_server)
+    change(catalogue)
+    library = server.load_library()
+    assert library.update_library(verbose=False) > 0
+    server.pickle(library)
+    assert library.store.load_journal(server)['artists']
+
+    fresh = make_server(storage="snapshot")
+    fresh.library.fill_artists()
+    # Read back with the journal applied over the snapshot, first without loading the artists
+    library = make_server(storage="snapshot").load_library()
+    assert [x.data_dict['id'] for x in library.find('artists', 'renamed')[0]] == ['2']
+    assert library.get_album_by_id('1') is None
+    assert tree(library) == tree(fresh.library)
+
+    server = make_server(storage="snapshot")
+    library = server.load_library()
+    server.pickle(library, True)
+    assert library.store.load_journal(server) == {'meta': {}, 'artists': []}
+    assert tree(make_server(storage="snapshot").load_library()) == tree(fresh.library)
+
+
+def test_journal_of_an_older_snapshot_is_not_replayed(make_server, catalogue):
+    server = saved(make_server)
+    catalogue.artists['2']['name'] = 'Renamed'
+    catalogue.touch()
+    library = server.load_library()
+    assert library.update_library(verbose=False) == 1
+    server.pickle(library)
+
+    # A crash after the new snapshot replaced the old one, but before the journal went away
+    journal = server.store.journal_path
+    shutil.copy(journal, journal + ".old")
+    catalogue.artists['2']['name'] = 'Renamed Again'
+    catalogue.touch()
+    assert library.update_library(verbose=False) == 1
+    server.pickle(library, True)
+    shutil.move(journal + ".old", journal)
+
+    reopened = make_server(storage="snapshot").load_library()
+    assert reopened.get_artist_by_id('2').data_dict['name'] == 'Renamed Again'
+    assert reopened.last_update == library.last_update
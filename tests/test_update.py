@@ -0,0 +1,112 @@
+"""Bring a library in line with a changed catalogue, and check it ends up
+the same as one built from scratch. """
+
+import pytest
+
+from conftest import tree
+
+
+def build(make_server) -> 'pysonic.Library':
+    server = make_server()
+    server.library.fill_artists()
+    return server.library
+
+
+def move_album(catalogue, album_id: str, artist_id: str) -> None:
+    """Retag an album and its songs to another artist. """
+
+    album = catalogue.albums[album_id]
+    old_artist = catalogue.artists[album['artistId']]
+    old_artist['albumCount'] = str(int(old_artist['albumCount']) - 1)
+    artist = catalogue.artists[artist_id]
+    artist['albumCount'] = str(int(artist['albumCount']) + 1)
+    album.update(artistId=artist_id, artist=artist['name'])
+    for one_song in catalogue.album_songs(album_id):
+        one_song.update(artistId=artist_id, artist=artist['name'])
+
+
+def test_unchanged_catalogue_is_not_fetched_again(make_server, catalogue_server):
+    library = build(make_server)
+    before = tree(library)
+    requests = catalogue_server.requests
+
+    assert library.update_library(verbose=False) == 0
+    # Once the server has given its time, it is asked whether anything changed since then
+    assert library.update_library(verbose=False) == 0
+    assert catalogue_server.requests - requests == 2
+    assert catalogue_server.pages['getIndexes'] == 2
+    assert tree(library) == before
+
+
+def test_album_retagged_to_another_artist(make_server, catalogue):
+    library = build(make_server)
+    move_album(catalogue, '1', '2')
+    catalogue.touch()
+
+    assert library.update_library(verbose=False) > 0
+    assert tree(library) == tree(build(make_server))
+    library.update_ids()
+    assert library.get_album_by_id('1') in library.get_artist_by_id('2').albums
+    assert library.get_album_by_id('1') not in library.get_artist_by_id('1').albums
+
+
+def test_artist_left_without_albums_is_dropped(make_server, catalogue):
+    library = build(make_server)
+    for album_id in [x['id'] for x in catalogue.artist_albums('3')]:
+        move_album(catalogue, album_id, '4')
+    del catalogue.artists['3']
+    catalogue.touch()
+
+    assert library.update_library(verbose=False) > 0
+    assert tree(library) == tree(build(make_server))
+    assert '3' not in [x.data_dict['id'] for x in library]
+
+
+def test_album_removed(make_server, catalogue):
+    library = build(make_server)
+    del catalogue.albums['5']
+    catalogue.artists['2']['albumCount'] = '2'
+    catalogue.touch()
+
+    assert library.update_library(verbose=False) > 0
+    assert tree(library) == tree(build(make_server))
+    library.update_ids()
+    assert library.get_album_by_id('5') is None
+    assert library.get_song_by_id(catalogue.album_song_ids['5'][0]) is None
+
+
+def test_artist_renamed(make_server, catalogue):
+    library = build(make_server)
+    library.get_token_index()
+    catalogue.artists['2']['name'] = 'Renamed'
+    catalogue.touch()
+
+    assert library.update_library(verbose=False) == 1
+    assert tree(library) == tree(build(make_server))
+    assert [x.data_dict['id'] for x in library.find('artists', 'renamed')[0]] == ['2']
+    assert '2' not in [x.data_dict['id'] for x in library.find('artists', 'artist')[0]]
+
+
+@pytest.mark.parametrize('storage', ['sqlite', 'snapshot'])
+@pytest.mark.parametrize('index_loaded', [True, False])
+def test_saved_index_follows_saved_changes(make_server, catalogue, storage, index_loaded):
+    server = make_server(storage=storage)
+    server.library.fill_artists()
+    server.library.get_token_index()
+    server.pickle()
+
+    # The next start changes the library, and only the changes are saved
+    server = make_server(storage=storage)
+    library = server.load_library()
+    catalogue.artists['2']['name'] = 'Renamed'
+    catalogue.touch()
+    assert library.update_library(verbose=False) == 1
+    if not index_loaded:
+        library.token_index = None
+    server.pickle(library)
+
+    # The start after that still has a saved index to use, with the change in it
+    library = make_server(storage=storage).load_library()
+    assert library.load_token_index() is not None
+    assert [x.data_dict['id'] for x in library.find('artists', 'renamed')[0]] == ['2']
+    assert '2' not in [x.data_dict['id'] for x in library.find('artists', 'artist')[0]]